@@ -0,0 +1,231 @@
+import uuid
+import time
+import logging
+from collections import defaultdict
+
+from app import db, Increment
+from models import to_epoch_day, to_epoch_month, format_day
+
+# Running per-user totals live in their own collection, one document per user
+AGGREGATES_COLLECTION = 'expense_stats'
+# Counts and totals per user and category or day, one document per cell, so
+# a write only touches the cells it changes however long the history is
+COUNTS_COLLECTION = 'expense_counts'
+# One document per user, month and category with that cell's count and total
+ROLLUPS_COLLECTION = 'expense_rollups'
+# Cells in both are deleted in the same commit that brings their count to 0
+
+def _count_id(user_id, kind, key):
+    return f"{user_id}:{kind}:{key}"
+
+def _add_to_counts(counts, expense, sign):
+    """Add (sign=1) or remove (sign=-1) one expense from (kind, key) -> [count, total] cells"""
+    amount = float(expense.get('amount') or 0)
+    keys = [('category', expense.get('category'))]
+    day = to_epoch_day(expense.get('date'))
+    if day is not None:
+        keys.append(('day', format_day(day)))
+    for key in keys:
+        cell = counts[key]
+        cell[0] += sign
+        cell[1] += sign * amount
+
+def _rollup_id(user_id, month, category):
+    return f"{user_id}:{month}:{category}"
+
+def _add_to_rollups(cells, expense, sign):
+    """Add (sign=1) or remove (sign=-1) one expense from (month, category) cells"""
+    day = to_epoch_day(expense.get('date'))
+    if day is None:
+        return
+    cell = cells[(to_epoch_month(day), expense.get('category'))]
+    cell[0] += sign
+    cell[1] += sign * float(expense.get('amount') or 0)
+
+def _replace_counts(batch, user_id, counts):
+    """Add writes swapping a user's stored count cells for freshly computed ones"""
+    collection = db.collection(COUNTS_COLLECTION)
+    # Deleting everything first lets the new cells go out as plain creates
+    for doc in collection.where('user_id', '==', user_id).stream():
+        batch.delete(doc)
+    for (kind, key), (count, total) in counts.items():
+        batch.create(collection.document(_count_id(user_id, kind, key)), {
+            'user_id': user_id,
+            'kind': kind,
+            'key': key,
+            'count': count,
+            'total': total
+        })
+
+def _replace_rollups(batch, user_id, cells):
+    """Add writes swapping a user's stored rollups for freshly computed cells"""
+    rollups = db.collection(ROLLUPS_COLLECTION)
+    for doc in rollups.where('user_id', '==', user_id).stream():
+        batch.delete(doc)
+    for (month, category), (count, total) in cells.items():
+        batch.create(rollups.document(_rollup_id(user_id, month, category)), {
+            'user_id': user_id,
+            'month': month,
+            'category': category,
+            'count': count,
+            'total': total
+        })
+
+def build_user_aggregates(user_id):
+    """Recompute a user's aggregates, counts and monthly rollups from their expenses and store them
+    
+    Runs in a transaction locking the user's stats, which every write
+    through record_expense_changes also updates, so expense writes made
+    meanwhile wait and are then counted on top of the rebuilt figures.
+    """
+    expenses = db.collection('expenses').where('user_id', '==', user_id)
+    stats = db.collection(AGGREGATES_COLLECTION).document(user_id)
+    # Collections written in the transaction must exist before it starts
+    db.collection(COUNTS_COLLECTION)
+    db.collection(ROLLUPS_COLLECTION)
+    
+    with db.transaction(stats):
+        aggregates = {
+            'user_id': user_id,
+            'count': 0,
+            'total': 0.0,
+            # Changes on every write so caches keyed on it never serve stale data
+            'version': uuid.uuid4().hex,
+            # Unix time of the last change, for Last-Modified headers
+            'updated_at': time.time(),
+            # Only set by full builds; stats created by increments alone are rebuilt
+            'complete': True
+        }
+        counts = defaultdict(lambda: [0, 0.0])
+        cells = defaultdict(lambda: [0, 0.0])
+        for doc in expenses.stream():
+            expense = doc.to_dict()
+            aggregates['count'] += 1
+            aggregates['total'] += float(expense.get('amount') or 0)
+            _add_to_counts(counts, expense, 1)
+            _add_to_rollups(cells, expense, 1)
+        
+        batch = db.batch()
+        _replace_counts(batch, user_id, counts)
+        _replace_rollups(batch, user_id, cells)
+        batch.set(stats, aggregates)
+        batch.commit()
+    return aggregates
+
+def get_aggregate_details(user_id):
+    """Category totals, the number of days with expenses and the largest amount"""
+    counts = db.collection(COUNTS_COLLECTION).where('user_id', '==', user_id)
+    categories = {}
+    for doc in counts.where('kind', '==', 'category').stream():
+        cell = doc.to_dict()
+        categories[cell['key']] = {'count': cell['count'], 'total': cell['total']}
+    
+    # Read off the (user_id, amount) index rather than kept per write
+    largest = db.collection('expenses') \
+        .where('user_id', '==', user_id) \
+        .where('amount', '!=', None) \
+        .order_by('amount', direction='DESCENDING') \
+        .limit(1)
+    max_amount = max((float(doc.to_dict()['amount']) for doc in largest.stream()), default=0.0)
+    
+    return {
+        'categories': categories,
+        'num_days': counts.where('kind', '==', 'day').count(),
+        'max_amount': max_amount
+    }
+
+def get_user_aggregates(user_id, details=False):
+    """Load a user's aggregates, building them once for users that predate them
+    
+    details=True adds the get_aggregate_details fields the stats need.
+    """
+    doc = db.collection(AGGREGATES_COLLECTION).document(user_id).get()
+    if doc.exists and doc.to_dict().get('complete'):
+        aggregates = doc.to_dict()
+    else:
+        logging.info(f"Building expense aggregates for user {user_id}")
+        aggregates = build_user_aggregates(user_id)
+    if details:
+        aggregates.update(get_aggregate_details(user_id))
+    return aggregates
+
+def record_expense_change(user_id, old_expense=None, new_expense=None, batch=None):
+    """Fold one expense write into the user's aggregates
+    
+    Pass the stored data before the write as old_expense (None for an add)
+    and after it as new_expense (None for a delete).
+    """
+    record_expense_changes(user_id, [(old_expense, new_expense)], batch=batch)
+
+def record_expense_changes(user_id, changes, batch=None):
+    """Fold a batch of (old_expense, new_expense) writes into the user's aggregates
+    
+    Totals and cells are bumped with store-side increments, so concurrent
+    writes never lose updates, and only the cells the writes touch are
+    written. Pass the batch holding the expense writes to commit both
+    together; without one the changes are committed on their own.
+    """
+    stats = db.collection(AGGREGATES_COLLECTION).document(user_id)
+    own_batch = batch is None
+    if own_batch:
+        batch = db.batch()
+    try:
+        count, total = 0, 0.0
+        counts = defaultdict(lambda: [0, 0.0])
+        cells = defaultdict(lambda: [0, 0.0])
+        for old_expense, new_expense in changes:
+            for expense, sign in ((old_expense, -1), (new_expense, 1)):
+                if expense is None:
+                    continue
+                count += sign
+                total += sign * float(expense.get('amount') or 0)
+                _add_to_counts(counts, expense, sign)
+                _add_to_rollups(cells, expense, sign)
+        
+        # Stats missing here are created without 'complete', so the next
+        # read rebuilds everything from the expenses
+        batch.set(stats, {
+            'user_id': user_id,
+            'count': Increment(count),
+            'total': Increment(total),
+            'version': uuid.uuid4().hex,
+            'updated_at': time.time()
+        }, merge=True)
+        # (doc, identifying fields, count change, total change) per touched cell
+        cell_changes = []
+        collection = db.collection(COUNTS_COLLECTION)
+        for (kind, key), (cell_count, cell_total) in counts.items():
+            fields = {'user_id': user_id, 'kind': kind, 'key': key}
+            cell_changes.append((collection.document(_count_id(user_id, kind, key)), fields, cell_count, cell_total))
+        rollups = db.collection(ROLLUPS_COLLECTION)
+        for (month, category), (cell_count, cell_total) in cells.items():
+            fields = {'user_id': user_id, 'month': month, 'category': category}
+            cell_changes.append((rollups.document(_rollup_id(user_id, month, category)), fields, cell_count, cell_total))
+        for doc, fields, cell_count, cell_total in cell_changes:
+            if cell_count or cell_total:
+                batch.set(doc, {**fields, 'count': Increment(cell_count), 'total': Increment(cell_total)}, merge=True)
+        # Cells a removal may have emptied are deleted after all increments,
+        # so those still go out as one statement per collection
+        for doc, _, cell_count, _ in cell_changes:
+            if cell_count < 0:
+                batch.delete_if(doc, 'count', '<=', 0)
+        if own_batch:
+            batch.commit()
+    except Exception as e:
+        # Never fail the write itself; rebuild from scratch on next read
+        logging.error(f"Error updating expense aggregates: {e}")
+        if own_batch:
+            stats.delete()
+        else:
+            batch.delete(stats)
+
+def get_monthly_rollups(user_id, category=None):
+    """A user's rollup cells, oldest month first, optionally for one category.
+    
+    Rollups are built along with the aggregates, so call get_user_aggregates
+    first for users that may predate them.
+    """
+    query = db.collection(ROLLUPS_COLLECTION).where('user_id', '==', user_id)
+    if category is not None:
+        query = query.where('category', '==', category)
+    return [doc.to_dict() for doc in query.order_by('month').stream()]
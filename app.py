@@ -1,9 +1,18 @@
 import os
+import time
 import logging
 import uuid
+import contextlib
+import itertools
+import bisect
+import threading
+from collections import OrderedDict, defaultdict
 from flask import Flask
 from flask_login import LoginManager
-from werkzeug.security import generate_password_hash, check_password_hash
+from passwords import PasswordHashBusy, hash_password, check_password, needs_rehash
+from models import normalize_expense_data
+import instrumentation
+from instrumentation import timed
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -11,40 +20,234 @@ logging.basicConfig(level=logging.DEBUG)
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "expense-tracker-secret-key")
 
+# Server-Timing headers, /metrics histograms and the opt-in profiler
+instrumentation.init_app(app)
+
 # Get environment variables for Google OAuth
 has_google_oauth = os.environ.get("GOOGLE_OAUTH_CLIENT_ID") and os.environ.get("GOOGLE_OAUTH_CLIENT_SECRET")
 
+class DocumentExistsError(Exception):
+    """Raised when a write would duplicate an existing document or unique key"""
+
+class Increment:
+    """Merge-write value that adds to the stored number, like Firestore's Increment.
+    
+    Applied by the store in the write itself, so concurrent increments of
+    the same field are never lost; a missing field counts as 0.
+    """
+    
+    def __init__(self, value):
+        self.value = value
+    
+    def __repr__(self):
+        return f"Increment({self.value!r})"
+
+def merge_values(current, data):
+    """Document data after merging data into current, resolving increments"""
+    merged = dict(current)
+    for key, value in data.items():
+        merged[key] = (current.get(key) or 0) + value.value if isinstance(value, Increment) else value
+    return merged
+
+# Canonical encodings applied to every write into a collection, so stored
+# data never needs converting on the read side
+NORMALIZERS = {
+    'expenses': normalize_expense_data,
+}
+
 # Create a Mock DB for development
 class MockDB:
+    # Secondary indexes kept per collection: hash indexes map a field value
+    # to document ids, sorted indexes keep each group ordered by a sort field
+    # and unique indexes map a field value to the single document holding it
+    INDEXES = {
+        'expenses': {
+            'hash': ('user_id',),
+            'sorted': (('user_id', 'date'), ('user_id', 'amount')),
+        },
+        'users': {
+            'unique': ('email',),
+        },
+        'expense_rollups': {
+            'hash': ('user_id',),
+            'sorted': (('user_id', 'month'),),
+        },
+        'expense_counts': {
+            'hash': ('user_id',),
+        },
+    }
+    
     def __init__(self):
         self.collections = {}
         logging.warning("Using MockDB - this is only for development")
     
+    def batch(self):
+        return MockWriteBatch()
+    
+    def get_all(self, docs):
+        """Fetch several documents at once, in the order given"""
+        return [doc.get() for doc in docs]
+    
+    @contextlib.contextmanager
+    def transaction(self, doc):
+        """Run the block with no other writes applied, like SQLDB.transaction.
+        
+        There are no row locks here, so this holds the lock of every
+        collection that exists when it starts, in name order like batch
+        commits; get the collections the block writes to beforehand.
+        """
+        with contextlib.ExitStack() as stack:
+            for name in sorted(self.collections):
+                stack.enter_context(self.collections[name].lock)
+            yield
+    
     def collection(self, name):
         if name not in self.collections:
-            self.collections[name] = MockCollection(name)
+            indexes = self.INDEXES.get(name, {})
+            self.collections[name] = MockCollection(
+                name,
+                hash_fields=indexes.get('hash', ()),
+                sorted_fields=indexes.get('sorted', ()),
+                unique_fields=indexes.get('unique', ()),
+                normalize=NORMALIZERS.get(name)
+            )
         return self.collections[name]
 
 class MockCollection:
-    def __init__(self, name):
+    def __init__(self, name, hash_fields=(), sorted_fields=(), unique_fields=(), normalize=None):
         self.name = name
         self.documents = {}
+        self.normalize = normalize or dict
+        # Serializes writes so unique checks and index updates are atomic
+        self.lock = threading.RLock()
+        # field -> value -> set of doc ids
+        self.hash_indexes = {field: defaultdict(set) for field in hash_fields}
+        # (group field, sort field) -> group value -> sorted [(sort value, doc id)]
+        self.sorted_indexes = {fields: defaultdict(list) for fields in sorted_fields}
+        # field -> value -> doc id
+        self.unique_indexes = {field: {} for field in unique_fields}
     
     def document(self, doc_id):
         if doc_id not in self.documents:
-            self.documents[doc_id] = MockDocument(doc_id)
+            self.documents[doc_id] = MockDocument(doc_id, self)
         return self.documents[doc_id]
     
+    def _check_unique(self, doc_id, data):
+        for field, index in self.unique_indexes.items():
+            value = data.get(field)
+            if value is not None and index.get(value, doc_id) != doc_id:
+                raise DocumentExistsError(f"{self.name}: {field} {value!r} already exists")
+    
+    def _index_keys(self, doc_id, data):
+        for field, index in self.unique_indexes.items():
+            if data.get(field) is not None:
+                index[data[field]] = doc_id
+        for field, index in self.hash_indexes.items():
+            index[data.get(field)].add(doc_id)
+    
+    def _unindex_keys(self, doc_id, data):
+        for field, index in self.unique_indexes.items():
+            if index.get(data.get(field)) == doc_id:
+                del index[data[field]]
+        for field, index in self.hash_indexes.items():
+            value = data.get(field)
+            index[value].discard(doc_id)
+            if not index[value]:
+                del index[value]
+    
+    def _index(self, doc_id, data):
+        self._index_keys(doc_id, data)
+        for (group_field, sort_field), index in self.sorted_indexes.items():
+            sort_value = data.get(sort_field)
+            if sort_value is not None:
+                bisect.insort(index[data.get(group_field)], (sort_value, doc_id))
+    
+    def _unindex(self, doc_id, data):
+        self._unindex_keys(doc_id, data)
+        for (group_field, sort_field), index in self.sorted_indexes.items():
+            sort_value = data.get(sort_field)
+            if sort_value is None:
+                continue
+            group = data.get(group_field)
+            entries = index[group]
+            position = bisect.bisect_left(entries, (sort_value, doc_id))
+            if position < len(entries) and entries[position] == (sort_value, doc_id):
+                entries.pop(position)
+            if not entries:
+                del index[group]
+    
+    def _reindex(self, doc_id, old_data, new_data):
+        """Move a document between index entries after a write"""
+        if old_data is not None:
+            self._unindex(doc_id, old_data)
+        if new_data is not None:
+            self._index(doc_id, new_data)
+    
+    def _check_unique_many(self, docs):
+        """Unique check for a batch of (doc id, data), including clashes within it"""
+        for field, index in self.unique_indexes.items():
+            claimed = {}
+            for doc_id, data in docs:
+                value = data.get(field)
+                if value is None:
+                    continue
+                if claimed.setdefault(value, doc_id) != doc_id or index.get(value, doc_id) != doc_id:
+                    raise DocumentExistsError(f"{self.name}: {field} {value!r} already exists")
+    
+    def _reindex_many(self, changes):
+        """Apply a batch of (doc id, old data, new data) index moves.
+        
+        Each touched sorted index group is filtered and re-sorted once for
+        the whole batch rather than shifted once per document.
+        """
+        removed = defaultdict(set)
+        added = defaultdict(list)
+        for doc_id, old_data, new_data in changes:
+            if old_data is not None:
+                self._unindex_keys(doc_id, old_data)
+            if new_data is not None:
+                self._index_keys(doc_id, new_data)
+            for fields in self.sorted_indexes:
+                group_field, sort_field = fields
+                if old_data is not None and old_data.get(sort_field) is not None:
+                    removed[(fields, old_data.get(group_field))].add((old_data[sort_field], doc_id))
+                if new_data is not None and new_data.get(sort_field) is not None:
+                    added[(fields, new_data.get(group_field))].append((new_data[sort_field], doc_id))
+        
+        for (fields, group), entries in removed.items():
+            index = self.sorted_indexes[fields]
+            remaining = [entry for entry in index.get(group, ()) if entry not in entries]
+            if remaining:
+                index[group] = remaining
+            else:
+                index.pop(group, None)
+        for (fields, group), entries in added.items():
+            index = self.sorted_indexes[fields]
+            existing = index[group]
+            entries.sort()
+            if not existing or existing[-1] <= entries[0]:
+                existing.extend(entries)
+                continue
+            # Merge by bisecting each new entry into the existing run, so the
+            # old entries are copied in slices rather than compared one by one
+            merged = []
+            start = 0
+            for entry in entries:
+                position = bisect.bisect_left(existing, entry, start)
+                merged += existing[start:position]
+                merged.append(entry)
+                start = position
+            merged += existing[start:]
+            index[group] = merged
+    
     def where(self, field, op, value):
-        # No need to implement actual filtering for the demo
-        # Just return self to allow chaining
-        return self
+        return MockQuery(self).where(field, op, value)
     
     def order_by(self, field, direction='asc'):
-        return self
+        return MockQuery(self).order_by(field, direction)
     
     def limit(self, limit_value):
-        return self
+        return MockQuery(self).limit(limit_value)
     
     def stream(self):
         # Return only documents that exist
@@ -56,35 +259,367 @@ class MockCollection:
         doc.set(data)
         return doc
 
+class MockQuery:
+    """Chainable query over a MockCollection, mirroring the Firestore API"""
+    OPERATORS = {
+        '==': lambda a, b: a == b,
+        '!=': lambda a, b: a != b,
+        '<': lambda a, b: a is not None and a < b,
+        '<=': lambda a, b: a is not None and a <= b,
+        '>': lambda a, b: a is not None and a > b,
+        '>=': lambda a, b: a is not None and a >= b,
+        'in': lambda a, b: a in b,
+        'not-in': lambda a, b: a not in b,
+    }
+    
+    def __init__(self, collection):
+        self.collection = collection
+        self.filters = []
+        self.orders = []
+        self.limit_value = None
+        self.cursor = None
+    
+    def _copy(self):
+        query = MockQuery(self.collection)
+        query.filters = list(self.filters)
+        query.orders = list(self.orders)
+        query.limit_value = self.limit_value
+        query.cursor = self.cursor
+        return query
+    
+    def where(self, field, op, value):
+        if op not in self.OPERATORS:
+            raise ValueError(f"Unsupported query operator: {op}")
+        query = self._copy()
+        query.filters.append((field, self.OPERATORS[op], value))
+        return query
+    
+    def order_by(self, field, direction='asc'):
+        query = self._copy()
+        descending = str(direction).lower() in ('desc', 'descending')
+        query.orders.append((field, descending))
+        return query
+    
+    def limit(self, limit_value):
+        query = self._copy()
+        query.limit_value = limit_value
+        return query
+    
+    def start_after(self, value, doc_id):
+        """Resume a single-key ordered query after the (value, doc id) cursor.
+        
+        Ties on the order field are broken by document id in the same
+        direction, so keyset pages never overlap or skip documents.
+        Documents missing the order field sort last, also by id, and a
+        None value puts the cursor among them.
+        """
+        if len(self.orders) != 1:
+            raise ValueError("start_after requires exactly one order_by field")
+        query = self._copy()
+        query.cursor = (value, doc_id)
+        return query
+    
+    def _after_cursor(self, doc):
+        value = doc._data.get(self.orders[0][0])
+        cursor_value, cursor_id = self.cursor
+        descending = self.orders[0][1]
+        if cursor_value is None:
+            return value is None and (doc.id < cursor_id if descending else doc.id > cursor_id)
+        if value is None:
+            return True
+        if descending:
+            return (value, doc.id) < self.cursor
+        return (value, doc.id) > self.cursor
+    
+    def _matches(self, data):
+        return all(op(data.get(field), value) for field, op, value in self.filters)
+    
+    def _equality_value(self, field):
+        for filter_field, op, value in self.filters:
+            if filter_field == field and op is self.OPERATORS['==']:
+                return True, value
+        return False, None
+    
+    # Operator -> (bisect function, whether it bounds the start of the range)
+    RANGE_BOUNDS = {
+        '>=': (bisect.bisect_left, True),
+        '>': (bisect.bisect_right, True),
+        '<=': (bisect.bisect_right, False),
+        '<': (bisect.bisect_left, False),
+    }
+    
+    def _range_bounds(self, field, entries):
+        """Slice of sorted (value, doc id) entries that range filters on field allow"""
+        start, stop = 0, len(entries)
+        ranged = False
+        for filter_field, op, value in self.filters:
+            if filter_field != field:
+                continue
+            for name, (search, is_start) in self.RANGE_BOUNDS.items():
+                if op is self.OPERATORS[name]:
+                    position = search(entries, value, key=lambda entry: entry[0])
+                    if is_start:
+                        start = max(start, position)
+                    else:
+                        stop = min(stop, position)
+                    ranged = True
+        return start, max(start, stop), ranged
+    
+    def _stream_sorted_index(self):
+        """Walk a presorted index for single-key orders on an equality group"""
+        if len(self.orders) != 1:
+            return None
+        sort_field, descending = self.orders[0]
+        for (group_field, indexed_field), index in self.collection.sorted_indexes.items():
+            found, group = self._equality_value(group_field)
+            if indexed_field != sort_field or not found:
+                continue
+            
+            group_entries = index.get(group, [])
+            # Range filters on the sort field become a slice of the index,
+            # so only matching entries are visited
+            start, stop, ranged = self._range_bounds(sort_field, group_entries)
+            entries = group_entries[start:stop] if ranged else group_entries
+            # Whether filters on the sort field let documents missing it match
+            missing_match = all(op(None, value) for field, op, value in self.filters if field == sort_field)
+            if self._equality_value(sort_field) == (True, None):
+                # Only documents missing the field can match
+                entries = []
+            elif self.cursor is not None and self.cursor[0] is None:
+                # The cursor is already past every document with the field
+                entries = []
+            elif self.cursor is not None and descending:
+                entries = entries[:bisect.bisect_left(entries, self.cursor)]
+            elif self.cursor is not None:
+                entries = entries[bisect.bisect_right(entries, self.cursor):]
+            doc_ids = (doc_id for _, doc_id in (reversed(entries) if descending else entries))
+            
+            # Documents without the sort field are not in the sorted index
+            # and always sort last, by id in the same direction
+            hash_index = self.collection.hash_indexes.get(group_field)
+            if missing_match and hash_index is not None and len(hash_index.get(group, ())) > len(group_entries):
+                listed = {doc_id for _, doc_id in group_entries}
+                unsorted = sorted((doc_id for doc_id in hash_index[group] if doc_id not in listed), reverse=descending)
+                if self.cursor is not None and self.cursor[0] is None:
+                    cursor_id = self.cursor[1]
+                    unsorted = [doc_id for doc_id in unsorted if (doc_id < cursor_id if descending else doc_id > cursor_id)]
+                doc_ids = itertools.chain(doc_ids, unsorted)
+            
+            docs = []
+            for doc_id in doc_ids:
+                doc = self.collection.documents[doc_id]
+                if doc.exists and self._matches(doc._data):
+                    docs.append(doc)
+                    if self.limit_value is not None and len(docs) >= self.limit_value:
+                        break
+            return docs
+        return None
+    
+    def _candidates(self):
+        """Narrow the scan with an index when an equality filter allows it"""
+        documents = self.collection.documents
+        for field, index in self.collection.unique_indexes.items():
+            found, value = self._equality_value(field)
+            if found:
+                return [documents[index[value]]] if value in index else []
+        for field, index in self.collection.hash_indexes.items():
+            found, value = self._equality_value(field)
+            if found:
+                return [documents[doc_id] for doc_id in index.get(value, ())]
+        return self.collection.stream()
+    
+    @timed('storage')
+    def stream(self):
+        docs = self._stream_sorted_index()
+        if docs is not None:
+            return docs
+        
+        docs = [doc for doc in self._candidates() if doc.exists and self._matches(doc._data)]
+        
+        # Apply sorts from the last key to the first so the first key wins;
+        # documents missing the field always sort last and the last key
+        # breaks ties by document id
+        for position, (field, descending) in enumerate(reversed(self.orders)):
+            present = [doc for doc in docs if doc._data.get(field) is not None]
+            missing = [doc for doc in docs if doc._data.get(field) is None]
+            if position == 0:
+                present.sort(key=lambda doc: (doc._data[field], doc.id), reverse=descending)
+                missing.sort(key=lambda doc: doc.id, reverse=descending)
+            else:
+                present.sort(key=lambda doc: doc._data[field], reverse=descending)
+            docs = present + missing
+        
+        if self.cursor is not None:
+            docs = [doc for doc in docs if self._after_cursor(doc)]
+        
+        if self.limit_value is not None:
+            docs = docs[:self.limit_value]
+        return docs
+    
+    def count(self):
+        """Number of matching documents"""
+        return len(self.stream())
+
 class MockDocument:
-    def __init__(self, id):
+    def __init__(self, id, collection=None):
         self.id = id
+        self.collection = collection
         self._data = {}
         self.exists = False
     
+    @timed('storage')
     def get(self):
         return self
     
-    def set(self, data):
+    def _lock(self):
+        return self.collection.lock if self.collection is not None else contextlib.nullcontext()
+    
+    def _normalize(self, data):
+        return dict(self.collection.normalize(data) if self.collection is not None else data)
+    
+    def _write(self, data):
+        """Replace the document data, enforcing unique keys and updating indexes"""
+        old_data = self._data if self.exists else None
+        if self.collection is not None:
+            self.collection._check_unique(self.id, data)
         self._data = data
         self.exists = True
+        if self.collection is not None:
+            self.collection._reindex(self.id, old_data, data)
+    
+    @timed('storage')
+    def create(self, data):
+        """Write the document only if it doesn't exist yet"""
+        with self._lock():
+            if self.exists:
+                raise DocumentExistsError(f"Document {self.id} already exists")
+            self._write(self._normalize(data))
         return True
     
+    @timed('storage')
+    def set(self, data, merge=False):
+        """Replace the document; with merge=True update or create it instead.
+        
+        Increment values in merged data are applied under the collection lock.
+        """
+        data = self._normalize(data)
+        with self._lock():
+            self._write(merge_values(self._data if self.exists else {}, data) if merge else data)
+        return True
+    
+    @timed('storage')
     def update(self, data):
-        self._data.update(data)
+        data = self._normalize(data)
+        with self._lock():
+            if self.exists:
+                self._write({**self._data, **data})
+            else:
+                self._data.update(data)
         return True
     
+    @timed('storage')
     def delete(self):
-        self._data = {}
-        self.exists = False
+        with self._lock():
+            old_data = self._data if self.exists else None
+            self._data = {}
+            self.exists = False
+            if self.collection is not None and old_data is not None:
+                self.collection._reindex(self.id, old_data, None)
         return True
     
     def to_dict(self):
-        return self._data
+        # Hand out a copy like Firestore snapshots do, so callers reformatting
+        # fields can't silently corrupt stored data or its indexes
+        return dict(self._data)
 
-# Set up database
-db = MockDB()
-logging.warning("Using mock database for development. Data will be stored in memory only.")
+class MockWriteBatch:
+    """Writes applied together on commit, like a Firestore WriteBatch.
+    
+    Every write is checked before any is applied, so a failing batch
+    leaves the store untouched, and indexes are updated once per
+    collection for the whole batch.
+    """
+    
+    def __init__(self):
+        self.writes = []
+    
+    def create(self, doc, data):
+        self.writes.append(('create', doc, data))
+        return self
+    
+    def set(self, doc, data, merge=False):
+        self.writes.append(('merge' if merge else 'set', doc, data))
+        return self
+    
+    def update(self, doc, data):
+        self.writes.append(('update', doc, data))
+        return self
+    
+    def delete(self, doc):
+        self.writes.append(('delete', doc, None))
+        return self
+    
+    def delete_if(self, doc, field, op, value):
+        """Delete the document if, after the writes before this one, field op value holds"""
+        self.writes.append(('delete_if', doc, (field, op, value)))
+        return self
+    
+    def __len__(self):
+        return len(self.writes)
+    
+    @timed('storage')
+    def commit(self):
+        collections = {doc.collection.name: doc.collection for _, doc, _ in self.writes}
+        with contextlib.ExitStack() as stack:
+            # Lock in name order so concurrent batches can't deadlock
+            for name in sorted(collections):
+                stack.enter_context(collections[name].lock)
+            
+            # doc -> data after the batch, None once deleted
+            staged = {}
+            for op, doc, data in self.writes:
+                current = staged[doc] if doc in staged else (doc._data if doc.exists else None)
+                if op == 'create':
+                    if current is not None:
+                        raise DocumentExistsError(f"Document {doc.id} already exists")
+                    staged[doc] = doc._normalize(data)
+                elif op == 'set':
+                    staged[doc] = doc._normalize(data)
+                elif op == 'merge':
+                    staged[doc] = merge_values(current or {}, doc._normalize(data))
+                elif op == 'update':
+                    if current is not None:
+                        staged[doc] = {**current, **doc._normalize(data)}
+                elif op == 'delete_if':
+                    field, operator, value = data
+                    if current is not None and MockQuery.OPERATORS[operator](current.get(field), value):
+                        staged[doc] = None
+                else:
+                    staged[doc] = None
+            for collection in collections.values():
+                collection._check_unique_many([
+                    (doc.id, data) for doc, data in staged.items()
+                    if doc.collection is collection and data is not None
+                ])
+            
+            changes = defaultdict(list)
+            for doc, data in staged.items():
+                changes[doc.collection].append((doc.id, doc._data if doc.exists else None, data))
+                doc._data = data if data is not None else {}
+                doc.exists = data is not None
+            for collection, collection_changes in changes.items():
+                collection._reindex_many(collection_changes)
+        self.writes = []
+        return True
+
+# Set up database: SQL-backed by default (DATABASE_URL, or a local SQLite
+# file), set USE_MOCK_DB to keep everything in process memory instead
+if os.environ.get("USE_MOCK_DB"):
+    db = MockDB()
+    logging.warning("Using mock database for development. Data will be stored in memory only.")
+else:
+    from sql_db import SQLDB
+    db = SQLDB(os.environ.get("DATABASE_URL", "sqlite:///expenses.db"))
 
 # Setup Flask-Login
 login_manager = LoginManager()
@@ -93,6 +628,53 @@ login_manager.login_view = "index"
 
 from models import User
 
+class UserCache:
+    """Per-worker LRU cache of loaded users, each kept for at most ttl seconds.
+    
+    Writes to a user record call invalidate() here; the TTL bounds how long
+    other workers can serve the old record.
+    """
+    
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            user, expires = entry
+            if time.monotonic() >= expires:
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return user
+    
+    def put(self, user_id, user):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries.pop(user_id, None)
+            self.entries[user_id] = (user, time.monotonic() + self.ttl)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+user_cache = UserCache(
+    max_entries=int(os.environ.get("USER_CACHE_MAX_ENTRIES", 10000)),
+    ttl=float(os.environ.get("USER_CACHE_TTL", 300))
+)
+
 @login_manager.user_loader
 def load_user(user_id):
     # Check if user_id is the demo user
@@ -106,7 +688,10 @@ def load_user(user_id):
         )
         return user
     
-    # Regular user flow
+    # Regular user flow, served from the cache when possible
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
     if db:
         try:
             user_doc = db.collection('users').document(user_id).get()
@@ -117,6 +702,7 @@ def load_user(user_id):
                     email=user_data.get('email', ''),
                     display_name=user_data.get('displayName', '')
                 )
+                user_cache.put(user_id, user)
                 return user
         except Exception as e:
             logging.error(f"Error loading user: {e}")
@@ -125,17 +711,18 @@ def load_user(user_id):
 # Email User Authentication Helper Functions
 def get_user_by_email(email):
     """Get a user by email from the database"""
-    users_collection = db.collection('users')
-    # Since we can't query by field in our mock DB, we need to iterate
-    for user_doc in users_collection.stream():
+    # Served by the unique email index on the users collection
+    for user_doc in db.collection('users').where('email', '==', email).limit(1).stream():
         user_data = user_doc.to_dict()
-        if user_data.get('email') == email:
-            user_data['id'] = user_doc.id
-            return user_data
+        user_data['id'] = user_doc.id
+        return user_data
     return None
 
 def create_user(email, password, display_name=None):
-    """Create a new user in the database"""
+    """Create a new user in the database
+    
+    Raises DocumentExistsError if a user with this email already exists.
+    """
     # Generate a unique ID for the user
     uid = f"email-user-{email.replace('@', '-').replace('.', '-')}"
     
@@ -143,22 +730,42 @@ def create_user(email, password, display_name=None):
     if not display_name:
         display_name = email.split('@')[0]
     
-    # Hash the password for security
-    password_hash = generate_password_hash(password)
+    # Hash the password for security; raises PasswordHashBusy when overloaded
+    password_hash = hash_password(password)
     
-    # Store the user in the database
-    db.collection('users').document(uid).set({
+    # Store the user in the database; create() fails atomically on a
+    # duplicate id or email, so concurrent registrations can't both succeed
+    db.collection('users').document(uid).create({
         'email': email,
         'displayName': display_name,
         'passwordHash': password_hash,
         'createdAt': None  # In a real app, use a proper datetime
     })
+    # Drop anything cached for a previous record with this id
+    user_cache.invalidate(uid)
     
     return uid
 
 def verify_password(stored_hash, password):
-    """Verify a password against its hash"""
-    return check_password_hash(stored_hash, password)
+    """Verify a password against its hash
+    
+    Raises PasswordHashBusy when too many hashes are already in flight.
+    """
+    return check_password(stored_hash, password)
+
+def upgrade_password_hash(uid, stored_hash, password):
+    """After a successful login, re-store the password if the hash parameters changed"""
+    if not needs_rehash(stored_hash):
+        return
+    try:
+        db.collection('users').document(uid).update({'passwordHash': hash_password(password)})
+        user_cache.invalidate(uid)
+        logging.info(f"Upgraded password hash for user {uid}")
+    except PasswordHashBusy:
+        # The login already succeeded; the next one tries again
+        pass
+    except Exception as e:
+        logging.error(f"Error upgrading password hash: {e}")
 
 # Import Google OAuth Blueprint if credentials are available
 if has_google_oauth:
@@ -171,3 +778,6 @@ if has_google_oauth:
 
 # Import routes after initializing app and login_manager to avoid circular imports
 from routes import *
+
+# Register Flask CLI commands
+import cli
@@ -0,0 +1,250 @@
+"""Benchmark the request hot paths through the Flask test client.
+
+Seeds a fresh store with synthetic users whose expense counts follow a
+Zipf-like skew (a few heavy users, a long tail of light ones), then drives
+each route and reports p50/p99 latency, throughput and peak Python memory
+per route. Requests pick users with the same skew, so heavy histories are
+exercised as often as they would be in production.
+
+    python benchmarks/hot_paths.py --rows 100000 --users 200 --output hot_paths.json
+    python benchmarks/hot_paths.py --backend mock --rows 1000000 --routes dashboard reports
+    python benchmarks/hot_paths.py --rows 100000 --baseline hot_paths.json
+
+Results are JSON; with --baseline the p50/p99 ratios against an earlier
+run are printed, so regressions between versions are easy to spot.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import numpy as np
+
+CATEGORIES = ['Food', 'Transport', 'Bills', 'Education', 'Entertainment', 'Shopping', 'Health', 'Misc']
+PASSWORD = 'benchmark-password'
+
+# Seeding through write batches keeps setup time reasonable at 1M rows
+SEED_BATCH_SIZE = 5000
+
+def user_email(index):
+    return f"bench{index}@example.com"
+
+def user_weights(users, skew):
+    weights = 1.0 / np.arange(1, users + 1) ** skew
+    return weights / weights.sum()
+
+def seed(db, rows, users, skew, rng):
+    """Create the users and spread rows expenses over them, heaviest first"""
+    from passwords import hash_password
+    from aggregates import build_user_aggregates
+    
+    # One hash shared by every user; hashing per user would dominate setup
+    password_hash = hash_password(PASSWORD)
+    user_ids = []
+    for index in range(users):
+        email = user_email(index)
+        uid = f"email-user-{email.replace('@', '-').replace('.', '-')}"
+        db.collection('users').document(uid).create({
+            'email': email,
+            'displayName': f"bench{index}",
+            'passwordHash': password_hash,
+            'createdAt': None
+        })
+        user_ids.append(uid)
+    
+    counts = rng.multinomial(rows, user_weights(users, skew))
+    start_day = datetime.date(2020, 1, 1).toordinal()
+    end_day = datetime.date.today().toordinal()
+    expenses = db.collection('expenses')
+    batch = []
+    
+    def flush():
+        write_batch = db.batch()
+        for data in batch:
+            write_batch.create(expenses.document(os.urandom(16).hex()), data)
+        write_batch.commit()
+        batch.clear()
+    
+    for uid, count in zip(user_ids, counts.tolist()):
+        amounts = np.round(rng.lognormal(3, 1, count), 2).tolist()
+        days = rng.integers(start_day, end_day + 1, count).tolist()
+        categories = rng.integers(0, len(CATEGORIES), count).tolist()
+        for amount, day, category in zip(amounts, days, categories):
+            batch.append({
+                'user_id': uid,
+                'amount': amount,
+                'category': CATEGORIES[category],
+                'date': datetime.datetime.fromordinal(day),
+                'description': 'synthetic'
+            })
+            if len(batch) >= SEED_BATCH_SIZE:
+                flush()
+    
+    if batch:
+        flush()
+    for uid in user_ids:
+        build_user_aggregates(uid)
+    return counts
+
+def login(client, index):
+    return client.post('/login', json={'email': user_email(index), 'password': PASSWORD})
+
+def add_expense(client, rng):
+    return client.post('/add-expense', data={
+        'amount': f"{rng.uniform(1, 100):.2f}",
+        'category': CATEGORIES[int(rng.integers(len(CATEGORIES)))],
+        'date': datetime.date.today().isoformat(),
+        'description': 'benchmark'
+    })
+
+# Route name -> request issued with a logged-in client for the chosen user
+ROUTES = {
+    'dashboard': lambda client, index, rng: client.get('/dashboard'),
+    'reports': lambda client, index, rng: client.get('/reports'),
+    'export-expenses': lambda client, index, rng: client.get('/export-expenses'),
+    'add-expense': lambda client, index, rng: add_expense(client, rng),
+    'login': lambda client, index, rng: login(client, index),
+}
+
+def run_route(route, clients, weights, requests, rng):
+    issue = ROUTES[route]
+    picks = rng.choice(len(weights), size=requests, p=weights).tolist()
+    timings = []
+    started = time.perf_counter()
+    for index in picks:
+        start = time.perf_counter()
+        response = issue(clients[index], index, rng)
+        # Drain streamed bodies so the full response is part of the timing
+        response.get_data()
+        timings.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{route} returned {response.status_code} for user {index}")
+    elapsed = time.perf_counter() - started
+    return timings, elapsed, picks
+
+def measure_peak_memory(route, clients, weights, requests, rng):
+    """Peak Python heap during requests; a separate pass as tracing slows them down"""
+    issue = ROUTES[route]
+    tracemalloc.start()
+    try:
+        for index in rng.choice(len(weights), size=requests, p=weights).tolist():
+            issue(clients[index], index, rng).get_data()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)['routes']
+    for route, stats in results['routes'].items():
+        if route not in baseline:
+            continue
+        before = baseline[route]
+        ratios = [f"{key} x{stats[key] / before[key]:.2f}" for key in ('p50_ms', 'p99_ms', 'peak_mb') if before[key]]
+        print(f"{route:<16} vs baseline  " + '  '.join(ratios))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=['sqlite', 'mock'], default='sqlite')
+    parser.add_argument('--rows', type=int, default=10000, help='total expenses across all users')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent for rows and requests per user')
+    parser.add_argument('--requests', type=int, default=50, help='timed requests per route')
+    parser.add_argument('--memory-requests', type=int, default=5, help='traced requests per route for peak memory')
+    parser.add_argument('--routes', nargs='+', choices=list(ROUTES), default=list(ROUTES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    args = parser.parse_args()
+    
+    workdir = tempfile.mkdtemp(prefix='hot-paths-')
+    if args.backend == 'mock':
+        os.environ['USE_MOCK_DB'] = '1'
+    else:
+        os.environ.pop('USE_MOCK_DB', None)
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    
+    import logging
+    from app import app, db
+    logging.disable(logging.WARNING)
+    app.config['TESTING'] = True
+    
+    rng = np.random.default_rng(args.seed)
+    random.seed(args.seed)
+    
+    start = time.perf_counter()
+    counts = seed(db, args.rows, args.users, args.skew, rng)
+    seed_seconds = time.perf_counter() - start
+    print(f"Seeded {args.rows} expenses for {args.users} users in {seed_seconds:.1f}s "
+          f"(heaviest user {counts.max()}, median {int(np.median(counts))})")
+    
+    weights = user_weights(args.users, args.skew)
+    clients = []
+    for index in range(args.users):
+        client = app.test_client()
+        login(client, index)
+        clients.append(client)
+    
+    results = {
+        'benchmark': 'hot_paths',
+        'revision': git_revision(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'backend': args.backend,
+        'rows': args.rows,
+        'users': args.users,
+        'skew': args.skew,
+        'seed': args.seed,
+        'seed_seconds': round(seed_seconds, 3),
+        'routes': {}
+    }
+    
+    for route in args.routes:
+        timings, elapsed, picks = run_route(route, clients, weights, args.requests, rng)
+        peak = measure_peak_memory(route, clients, weights, args.memory_requests, rng) if args.memory_requests else 0
+        timings_ms = np.array(timings) * 1000
+        stats = {
+            'requests': len(timings),
+            'p50_ms': round(float(np.percentile(timings_ms, 50)), 3),
+            'p99_ms': round(float(np.percentile(timings_ms, 99)), 3),
+            'mean_ms': round(float(timings_ms.mean()), 3),
+            'max_ms': round(float(timings_ms.max()), 3),
+            'throughput_rps': round(len(timings) / elapsed, 1),
+            'peak_mb': round(peak / 2**20, 3),
+            'mean_user_rows': round(float(counts[picks].mean()), 1)
+        }
+        results['routes'][route] = stats
+        print(f"{route:<16} p50 {stats['p50_ms']:9.2f}ms  p99 {stats['p99_ms']:9.2f}ms  "
+              f"{stats['throughput_rps']:8.1f} req/s  peak {stats['peak_mb']:7.2f}MB")
+    
+    # Whole-process high-water mark, including seeding
+    results['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        compare(results, args.baseline)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
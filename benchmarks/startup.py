@@ -0,0 +1,100 @@
+"""Measure worker startup cost: time and peak RSS to import the app.
+
+Each sample imports `main` in a fresh interpreter, the same way a gunicorn
+worker does, so module-level imports are what gets measured.
+
+    python benchmarks/startup.py --runs 10 --output startup.json
+    python benchmarks/startup.py --max-seconds 0.5 --max-rss-mb 120
+
+Exits non-zero when a limit is exceeded or a heavy module is imported at
+startup, so it can guard against regressions.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only load when a chart or export actually needs them
+LAZY_MODULES = ('pandas', 'plotly')
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'seconds': elapsed,
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'loaded': sorted({name.split('.')[0] for name in sys.modules} & set(%r)),
+}))
+""" % (LAZY_MODULES,)
+
+def sample(database_url):
+    env = dict(os.environ, DATABASE_URL=database_url)
+    env.pop('USE_MOCK_DB', None)
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE],
+        cwd=REPO_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--max-seconds', type=float, help='fail if the median import time is higher')
+    parser.add_argument('--max-rss-mb', type=float, help='fail if the median peak RSS is higher')
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as workdir:
+        database_url = 'sqlite:///' + os.path.join(workdir, 'startup.db')
+        # The first run creates the schema; keep it out of the numbers
+        sample(database_url)
+        samples = [sample(database_url) for _ in range(args.runs)]
+    
+    seconds = [s['seconds'] for s in samples]
+    rss_mb = [s['max_rss_kb'] / 1024 for s in samples]
+    results = {
+        'benchmark': 'startup',
+        'python': sys.version.split()[0],
+        'runs': args.runs,
+        'import_seconds': {
+            'median': statistics.median(seconds),
+            'min': min(seconds),
+            'max': max(seconds)
+        },
+        'peak_rss_mb': {
+            'median': statistics.median(rss_mb),
+            'min': min(rss_mb),
+            'max': max(rss_mb)
+        },
+        'lazy_modules_loaded': sorted({name for s in samples for name in s['loaded']})
+    }
+    
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    
+    failures = []
+    if results['lazy_modules_loaded']:
+        failures.append(f"imported at startup: {', '.join(results['lazy_modules_loaded'])}")
+    if args.max_seconds is not None and results['import_seconds']['median'] > args.max_seconds:
+        failures.append(f"median import time {results['import_seconds']['median']:.3f}s > {args.max_seconds}s")
+    if args.max_rss_mb is not None and results['peak_rss_mb']['median'] > args.max_rss_mb:
+        failures.append(f"median peak RSS {results['peak_rss_mb']['median']:.1f}MB > {args.max_rss_mb}MB")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
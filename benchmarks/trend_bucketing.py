@@ -0,0 +1,110 @@
+"""Compare trend bucketing: the NumPy routine against the old pandas groupby.
+
+The pandas path is the one the trend chart used before bucket_trend:
+build a DataFrame from the expenses, derive the date group with .dt and
+groupby(['date_group', 'category']).sum(). Both paths start from the same
+list of Expense objects and are checked to agree before timing.
+
+    python benchmarks/trend_bucketing.py --sizes 100 1000 100000 --output trend.json
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+from models import Expense, ExpenseColumns
+from utils import bucket_trend
+
+CATEGORIES = ['Food', 'Transport', 'Bills', 'Entertainment', 'Shopping', 'Health', 'Misc']
+PERIODS = ('week', 'month', 'year')
+
+def make_expenses(size, seed=0):
+    rng = random.Random(seed)
+    start = datetime.datetime(2020, 1, 1)
+    return [
+        Expense(
+            str(i), 'bench', round(rng.uniform(1, 200), 2), rng.choice(CATEGORIES),
+            start + datetime.timedelta(days=rng.randint(0, 5 * 365)), ''
+        )
+        for i in range(size)
+    ]
+
+def pandas_trend(expenses, period):
+    df = pd.DataFrame([
+        {'date': expense.date, 'amount': expense.amount, 'category': expense.category}
+        for expense in expenses
+    ])
+    if period == 'year':
+        df['date_group'] = df['date'].dt.strftime('%Y-%m')
+    else:
+        df['date_group'] = df['date'].dt.date
+    return df.groupby(['date_group', 'category'])['amount'].sum().reset_index()
+
+def numpy_trend(expenses, period):
+    columns = ExpenseColumns.from_expenses(expenses)
+    dated = columns.dated()
+    return bucket_trend(
+        columns.days[dated], columns.category_codes[dated], columns.amounts[dated], columns.categories, period
+    )
+
+def check(expenses, period):
+    expected = {
+        (str(row.date_group), row.category): row.amount
+        for row in pandas_trend(expenses, period).itertuples()
+    }
+    trend = numpy_trend(expenses, period)
+    actual = {
+        (str(trend['labels'][b]), trend['series'][s]): trend['totals'][b, s]
+        for b, s in zip(*np.nonzero(trend['present']))
+    }
+    assert expected.keys() == actual.keys(), f"{period}: bucket mismatch"
+    assert all(abs(expected[key] - actual[key]) < 1e-6 for key in expected), f"{period}: total mismatch"
+
+def measure(fn, expenses, period, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(expenses, period)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+    
+    results = []
+    for size in args.sizes:
+        expenses = make_expenses(size)
+        repeat = max(1, args.repeat if size <= 100000 else args.repeat // 5)
+        for period in PERIODS:
+            check(expenses, period)
+            pandas_seconds = measure(pandas_trend, expenses, period, repeat)
+            numpy_seconds = measure(numpy_trend, expenses, period, repeat)
+            results.append({
+                'rows': size,
+                'period': period,
+                'pandas_ms': round(pandas_seconds * 1000, 3),
+                'numpy_ms': round(numpy_seconds * 1000, 3),
+                'speedup': round(pandas_seconds / numpy_seconds, 1)
+            })
+            print(f"{size:>8} rows  {period:<5}  pandas {pandas_seconds * 1000:9.2f}ms  "
+                  f"numpy {numpy_seconds * 1000:9.2f}ms  x{pandas_seconds / numpy_seconds:.1f}")
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'trend_bucketing', 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
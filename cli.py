@@ -0,0 +1,16 @@
+import click
+
+from app import app, db
+from aggregates import build_user_aggregates
+
+@app.cli.command('backfill-rollups')
+@click.option('--user', 'user_ids', multiple=True, help='Only rebuild these users (repeatable).')
+def backfill_rollups(user_ids):
+    """Rebuild expense aggregates and monthly rollups from the stored expenses."""
+    if not user_ids:
+        user_ids = sorted({doc.to_dict().get('user_id') for doc in db.collection('expenses').stream()} - {None})
+    
+    for user_id in user_ids:
+        build_user_aggregates(user_id)
+    
+    click.echo(f"Rebuilt rollups for {len(user_ids)} users")
@@ -1,8 +1,9 @@
 
-import json
 import os
+import time
 import datetime
 import logging
+import threading
 
 import requests
 from flask import Blueprint, redirect, request, url_for, session, flash
@@ -14,7 +15,15 @@ from app import db
 # Configuration
 GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_OAUTH_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_OAUTH_CLIENT_SECRET")
-GOOGLE_DISCOVERY_URL = "https://accounts.google.com/.well-known/openid-configuration"
+# Overridable so logins can run against a local stub provider; plain http
+# endpoints also need OAUTHLIB_INSECURE_TRANSPORT=1
+GOOGLE_DISCOVERY_URL = os.environ.get("GOOGLE_DISCOVERY_URL", "https://accounts.google.com/.well-known/openid-configuration")
+# Seconds to keep the discovery document when the provider sends no max-age
+DISCOVERY_DEFAULT_TTL = int(os.environ.get("GOOGLE_DISCOVERY_TTL", 3600))
+# Seconds before retrying a failed refresh of a cached discovery document
+DISCOVERY_RETRY_DELAY = 60
+# Seconds to wait on the provider before failing the login
+PROVIDER_TIMEOUT = 10
 
 # Get the redirect URL based on environment
 REPLIT_DOMAIN = os.environ.get("REPLIT_DOMAIN") or os.environ.get("REPLIT_DEV_DOMAIN", "localhost")
@@ -23,6 +32,54 @@ REDIRECT_URL = "https://" + REPLIT_DOMAIN + "/google_login/callback" if REPLIT_D
 # OAuth 2 client setup
 client = WebApplicationClient(GOOGLE_CLIENT_ID) if GOOGLE_CLIENT_ID else None
 
+# One pooled session keeps connections to the provider open across logins
+http = requests.Session()
+
+_discovery_lock = threading.Lock()
+_discovery = {'document': None, 'expires': 0.0}
+
+def _cache_lifetime(headers):
+    """Seconds a response may be reused per its Cache-Control and Age headers, None if unspecified"""
+    directives = {}
+    for part in headers.get("Cache-Control", "").split(","):
+        name, _, value = part.strip().partition("=")
+        directives[name.lower()] = value.strip('"')
+    if "no-store" in directives or "no-cache" in directives:
+        return 0
+    try:
+        return max(0, int(directives["max-age"]) - int(headers.get("Age", 0)))
+    except (KeyError, ValueError):
+        return None
+
+def get_provider_config():
+    """Google's OpenID discovery document, cached for as long as the provider allows
+    
+    A failed refresh keeps serving the previous document rather than
+    failing the login.
+    """
+    if _discovery['document'] is not None and time.monotonic() < _discovery['expires']:
+        return _discovery['document']
+    
+    with _discovery_lock:
+        # Another request may have refreshed it while this one waited
+        if _discovery['document'] is not None and time.monotonic() < _discovery['expires']:
+            return _discovery['document']
+        try:
+            response = http.get(GOOGLE_DISCOVERY_URL, timeout=PROVIDER_TIMEOUT)
+            response.raise_for_status()
+            document = response.json()
+        except (requests.RequestException, ValueError) as e:
+            if _discovery['document'] is None:
+                raise
+            logging.warning(f"Could not refresh the Google discovery document, keeping the cached one: {e}")
+            _discovery['expires'] = time.monotonic() + DISCOVERY_RETRY_DELAY
+            return _discovery['document']
+        
+        lifetime = _cache_lifetime(response.headers)
+        _discovery['document'] = document
+        _discovery['expires'] = time.monotonic() + (DISCOVERY_DEFAULT_TTL if lifetime is None else lifetime)
+        return document
+
 # Create the Blueprint
 google_auth = Blueprint("google_oauth", __name__, url_prefix="/google_login")
 
@@ -36,7 +93,7 @@ def login():
             return redirect(url_for("demo_login"))
         
         # Find out what URL to hit for Google login
-        google_provider_cfg = requests.get(GOOGLE_DISCOVERY_URL).json()
+        google_provider_cfg = get_provider_config()
         authorization_endpoint = google_provider_cfg["authorization_endpoint"]
 
         # Use library to construct the request for Google login
@@ -66,7 +123,7 @@ def callback():
             return redirect(url_for("index"))
 
         # Find out what URL to hit to get tokens
-        google_provider_cfg = requests.get(GOOGLE_DISCOVERY_URL).json()
+        google_provider_cfg = get_provider_config()
         token_endpoint = google_provider_cfg["token_endpoint"]
         
         # Prepare and send request to get tokens
@@ -76,26 +133,28 @@ def callback():
             redirect_url=REDIRECT_URL,
             code=code
         )
-        token_response = requests.post(
+        token_response = http.post(
             token_url,
             headers=headers,
             data=body,
             auth=(GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET),
+            timeout=PROVIDER_TIMEOUT,
         )
-
+        
         # Parse the tokens
-        client.parse_request_body_response(json.dumps(token_response.json()))
+        client.parse_request_body_response(token_response.text)
         
         # Get user info
         userinfo_endpoint = google_provider_cfg["userinfo_endpoint"]
         uri, headers, body = client.add_token(userinfo_endpoint)
-        userinfo_response = requests.get(uri, headers=headers, data=body)
+        userinfo_response = http.get(uri, headers=headers, data=body, timeout=PROVIDER_TIMEOUT)
+        userinfo = userinfo_response.json()
         
-        if userinfo_response.json().get("email_verified"):
+        if userinfo.get("email_verified"):
             # Get user data
-            unique_id = userinfo_response.json()["sub"]
-            users_email = userinfo_response.json()["email"]
-            users_name = userinfo_response.json().get("given_name", users_email.split("@")[0])
+            unique_id = userinfo["sub"]
+            users_email = userinfo["email"]
+            users_name = userinfo.get("given_name", users_email.split("@")[0])
             
             # Create user in db
             user = User(
@@ -112,7 +171,7 @@ def callback():
         else:
             flash("User email not verified by Google.", "error")
             return redirect(url_for("index"))
-            
+    
     except Exception as e:
         logging.error(f"Callback error: {str(e)}")
         flash("Authentication failed. Please try again.", "error")
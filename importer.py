@@ -0,0 +1,146 @@
+import io
+import csv
+import json
+import math
+import uuid
+import logging
+
+from app import db
+from models import Expense, to_epoch_day
+from aggregates import record_expense_changes
+
+# Rows written per store batch; also the most rows held in memory at once
+IMPORT_BATCH_ROWS = 5000
+# Rejected rows beyond this are counted but not described
+MAX_REPORTED_ERRORS = 100
+# A JSON value that hasn't closed after this many characters is malformed
+MAX_JSON_ROW_CHARS = 64 * 1024
+JSON_READ_CHARS = 64 * 1024
+
+def parse_csv_rows(stream):
+    """Yield rows of an uploaded CSV file as dicts keyed by lower-case header.
+    
+    The header uses the export's column names: Date, Category, Amount,
+    Description.
+    """
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    for row in reader:
+        yield {(key or '').strip().lower(): value for key, value in row.items()}
+
+def parse_json_rows(stream):
+    """Yield values from a JSON array or from JSON Lines, reading in chunks"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig')
+    decoder = json.JSONDecoder()
+    buffer = ''
+    in_array = None
+    eof = False
+    
+    while True:
+        buffer = buffer.lstrip()
+        if buffer:
+            if in_array is None:
+                in_array = buffer[0] == '['
+                if in_array:
+                    buffer = buffer[1:]
+                    continue
+            if in_array and buffer[0] == ']':
+                return
+            if in_array and buffer[0] == ',':
+                buffer = buffer[1:]
+                continue
+            try:
+                value, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError as e:
+                if eof or len(buffer) > MAX_JSON_ROW_CHARS:
+                    raise ValueError(f"Invalid JSON: {e.msg}") from e
+            else:
+                # A bare number at the end of the buffer may continue in the next chunk
+                if end < len(buffer) or eof or isinstance(value, (dict, list)):
+                    buffer = buffer[end:]
+                    yield value
+                    continue
+        elif eof:
+            if in_array:
+                raise ValueError("Invalid JSON: unterminated array")
+            return
+        
+        chunk = text.read(JSON_READ_CHARS)
+        eof = not chunk
+        buffer += chunk
+
+def validate_expense_row(user_id, row):
+    """Check one imported row and return the expense data to store.
+    
+    Raises ValueError describing why the row was rejected.
+    """
+    if not isinstance(row, dict):
+        raise ValueError("Expected an object with date, category and amount")
+    row = {str(key).strip().lower(): value for key, value in row.items()}
+    
+    try:
+        amount = float(row.get('amount'))
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid amount: {row.get('amount')!r}")
+    if not math.isfinite(amount) or amount <= 0:
+        raise ValueError(f"Amount must be a positive number: {row.get('amount')!r}")
+    
+    category = row.get('category')
+    if not isinstance(category, str) or not category.strip():
+        raise ValueError("Missing category")
+    
+    # Only YYYY-MM-DD strings, as in the add form and the CSV export
+    date = row.get('date')
+    day = to_epoch_day(date.strip()) if isinstance(date, str) else None
+    if day is None:
+        raise ValueError(f"Invalid date, expected YYYY-MM-DD: {date!r}")
+    
+    description = row.get('description')
+    expense = Expense(
+        id=None,
+        user_id=user_id,
+        amount=amount,
+        category=category.strip(),
+        date=day,
+        description=str(description) if description is not None else ''
+    )
+    return expense.to_dict()
+
+def import_expenses(user_id, rows):
+    """Validate parsed rows and store them in batches
+    
+    Each batch is one store write, aggregates included. Returns the
+    number of imported and rejected rows and the first rejections; a file
+    that can't be parsed stops the import with an 'error', keeping the
+    batches already written.
+    """
+    result = {'imported': 0, 'rejected': 0, 'errors': []}
+    expenses = db.collection('expenses')
+    pending = []
+    
+    def flush():
+        batch = db.batch()
+        for data in pending:
+            batch.create(expenses.document(str(uuid.uuid4())), data)
+        record_expense_changes(user_id, [(None, data) for data in pending], batch=batch)
+        batch.commit()
+        result['imported'] += len(pending)
+        pending.clear()
+    
+    row_number = 0
+    try:
+        for row_number, row in enumerate(rows, 1):
+            try:
+                pending.append(validate_expense_row(user_id, row))
+            except ValueError as e:
+                result['rejected'] += 1
+                if len(result['errors']) < MAX_REPORTED_ERRORS:
+                    result['errors'].append({'row': row_number, 'error': str(e)})
+            if len(pending) >= IMPORT_BATCH_ROWS:
+                flush()
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        logging.warning(f"Expense import for user {user_id} stopped after row {row_number}: {e}")
+        result['error'] = f"Could not read the file after row {row_number}: {e}"
+    
+    if pending:
+        flush()
+    return result
@@ -0,0 +1,257 @@
+import os
+import sys
+import hmac
+import time
+import bisect
+import inspect
+import logging
+import functools
+import threading
+from collections import Counter, defaultdict
+
+from flask import Response, g, has_request_context, request, before_render_template, template_rendered
+
+# Spans and request histograms; set INSTRUMENTATION_ENABLED=0 to turn off
+ENABLED = os.environ.get("INSTRUMENTATION_ENABLED", "1") != "0"
+
+# Bearer token that /metrics and ?profile=1 requests must send; without it
+# /metrics answers 404 and profiling is never started
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# ?profile=1 returns a sampled profile instead of the page, only when this is set
+PROFILING_ENABLED = bool(os.environ.get("PROFILING_ENABLED"))
+
+# Per-response span timings in a Server-Timing header, only when this is set
+SERVER_TIMING_ENABLED = bool(os.environ.get("SERVER_TIMING_ENABLED"))
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL_MS", 5)) / 1000
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus style"""
+    
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+    
+    def render(self, metric, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{metric}_count{{{labels}}} {self.count}')
+        return lines
+
+class Metrics:
+    """Per-worker span and request histograms"""
+    
+    def __init__(self):
+        self.spans = defaultdict(Histogram)
+        self.requests = defaultdict(Histogram)
+        self.lock = threading.Lock()
+    
+    def observe_span(self, name, seconds):
+        with self.lock:
+            self.spans[name].observe(seconds)
+    
+    def observe_request(self, endpoint, seconds):
+        with self.lock:
+            self.requests[endpoint].observe(seconds)
+    
+    def render(self):
+        lines = [
+            '# HELP app_span_duration_seconds Time spent in instrumented code paths',
+            '# TYPE app_span_duration_seconds histogram'
+        ]
+        with self.lock:
+            for name, histogram in sorted(self.spans.items()):
+                lines.extend(histogram.render('app_span_duration_seconds', f'span="{name}"'))
+            lines.extend([
+                '# HELP app_request_duration_seconds Time to produce a response, per endpoint',
+                '# TYPE app_request_duration_seconds histogram'
+            ])
+            for endpoint, histogram in sorted(self.requests.items()):
+                lines.extend(histogram.render('app_request_duration_seconds', f'endpoint="{endpoint}"'))
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+def record_span(name, seconds):
+    """Add a finished span to the histograms and, inside a request, to its timings"""
+    metrics.observe_span(name, seconds)
+    if has_request_context():
+        spans = g.setdefault('spans', {})
+        total, calls = spans.get(name, (0.0, 0))
+        spans[name] = (total + seconds, calls + 1)
+
+class span:
+    """Time a block of code as a named span"""
+    
+    def __init__(self, name):
+        self.name = name
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        if ENABLED:
+            record_span(self.name, time.perf_counter() - self.start)
+
+def timed(group):
+    """Record calls to the decorated function as '<group>.<name>' spans.
+    
+    Generator functions are timed only while they run, not while the
+    consumer holds them between items.
+    """
+    def decorator(fn):
+        name = f"{group}.{fn.__name__}"
+        
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                if not ENABLED:
+                    yield from fn(*args, **kwargs)
+                    return
+                elapsed = 0.0
+                items = fn(*args, **kwargs)
+                try:
+                    while True:
+                        start = time.perf_counter()
+                        try:
+                            item = next(items)
+                        except StopIteration:
+                            return
+                        finally:
+                            elapsed += time.perf_counter() - start
+                        yield item
+                finally:
+                    items.close()
+                    record_span(name, elapsed)
+            return generator_wrapper
+        
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record_span(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+class SamplingProfiler:
+    """Sample one thread's stack at a fixed interval from a helper thread.
+    
+    The result is in the collapsed-stack format flame graph tools read:
+    one 'outer;...;inner count' line per distinct stack.
+    """
+    
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+    
+    def start(self):
+        self.thread.start()
+        return self
+    
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+    
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + '\n'
+
+def _server_timing(spans, total):
+    entries = [
+        f'{name};desc="{calls} call{"s" if calls != 1 else ""}";dur={seconds * 1000:.2f}'
+        for name, (seconds, calls) in sorted(spans.items(), key=lambda item: -item[1][0])
+    ]
+    entries.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(entries)
+
+def _has_metrics_token():
+    """Whether the request carries METRICS_TOKEN as its bearer token"""
+    if not METRICS_TOKEN:
+        return False
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(token.encode(), METRICS_TOKEN.encode())
+
+def init_app(app):
+    """Register request timing, template spans and the /metrics endpoint"""
+    if not ENABLED:
+        return
+    
+    @app.before_request
+    def start_request_timing():
+        g.request_start = time.perf_counter()
+        if PROFILING_ENABLED and request.args.get('profile') == '1' and _has_metrics_token():
+            g.profiler = SamplingProfiler(threading.get_ident()).start()
+    
+    @app.after_request
+    def finish_request_timing(response):
+        start = g.pop('request_start', None)
+        if start is None:
+            return response
+        total = time.perf_counter() - start
+        metrics.observe_request(request.endpoint or 'unknown', total)
+        
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            logging.info(f"Returning sampled profile for {request.path}")
+            response = Response(profiler.stop(), mimetype='text/plain')
+        
+        if SERVER_TIMING_ENABLED:
+            # Streamed bodies keep running after this, so they count up to the headers
+            response.headers['Server-Timing'] = _server_timing(g.get('spans', {}), total)
+        return response
+    
+    @app.teardown_request
+    def stop_profiler(exc):
+        # A request that raised never reached after_request
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.stop()
+    
+    def start_template_timing(sender, template, context, **extra):
+        g.setdefault('template_starts', []).append(time.perf_counter())
+    
+    def finish_template_timing(sender, template, context, **extra):
+        starts = g.get('template_starts')
+        if starts:
+            record_span(f"template.{template.name}", time.perf_counter() - starts.pop())
+    
+    # Signal receivers are held weakly, so keep references on the app
+    app.extensions['instrumentation'] = (start_template_timing, finish_template_timing)
+    before_render_template.connect(start_template_timing, app)
+    template_rendered.connect(finish_template_timing, app)
+    
+    @app.route('/metrics')
+    def metrics_endpoint():
+        # Traffic and timings per endpoint are only for the scraper
+        if not _has_metrics_token():
+            return Response('Not Found', status=404, mimetype='text/plain')
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
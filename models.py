@@ -1,4 +1,57 @@
+import datetime
+import numpy as np
 from flask_login import UserMixin
+from instrumentation import timed
+
+EPOCH = datetime.date(1970, 1, 1)
+EPOCH_ORDINAL = EPOCH.toordinal()
+# Day number used for expenses without a usable date
+MISSING_DAY = -2**31
+
+def to_epoch_day(date):
+    """Convert a stored or submitted expense date to days since the Unix epoch.
+    
+    Expenses are stored with this encoding; datetimes, dates and legacy
+    YYYY-MM-DD strings are converted, anything unusable becomes None.
+    """
+    if isinstance(date, int) and not isinstance(date, bool):
+        return date
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    elif isinstance(date, str):
+        try:
+            # fromisoformat is much faster; strptime also takes unpadded parts
+            date = datetime.date.fromisoformat(date[:10])
+        except ValueError:
+            try:
+                date = datetime.datetime.strptime(date[:10], '%Y-%m-%d').date()
+            except ValueError:
+                return None
+    elif not isinstance(date, datetime.date):
+        return None
+    return date.toordinal() - EPOCH_ORDINAL
+
+def format_day(day):
+    """Format an epoch day as YYYY-MM-DD for display and export"""
+    if day is None:
+        return ''
+    return datetime.date.fromordinal(EPOCH_ORDINAL + day).isoformat()
+
+def to_epoch_month(day):
+    """Months since January 1970 for an epoch day"""
+    date = datetime.date.fromordinal(EPOCH_ORDINAL + day)
+    return (date.year - EPOCH.year) * 12 + date.month - 1
+
+def format_month(month):
+    """Format an epoch month as YYYY-MM"""
+    year, index = divmod(month, 12)
+    return f"{EPOCH.year + year:04d}-{index + 1:02d}"
+
+def normalize_expense_data(data):
+    """Return expense fields with the date in the canonical epoch day encoding"""
+    if 'date' not in data or isinstance(data['date'], int):
+        return data
+    return {**data, 'date': to_epoch_day(data['date'])}
 
 class User(UserMixin):
     def __init__(self, uid, email, display_name):
@@ -34,3 +87,69 @@ class Expense:
             'date': self.date,
             'description': self.description
         }
+
+class ExpenseColumns:
+    """Column-oriented view of one user's expenses for vectorized analytics.
+    
+    Dates are stored as days since the Unix epoch and categories as integer
+    codes into `categories`, so totals and groupings run as NumPy operations
+    instead of per-row attribute access.
+    """
+    def __init__(self, ids, amounts, days, category_codes, categories, descriptions):
+        self.ids = ids
+        self.amounts = amounts
+        self.days = days
+        self.category_codes = category_codes
+        self.categories = categories
+        self.descriptions = descriptions
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    @staticmethod
+    @timed('models')
+    def from_records(records):
+        """Build columns from (id, data dict) pairs in a single pass"""
+        ids = []
+        amounts = []
+        days = []
+        codes = []
+        descriptions = []
+        category_index = {}
+        
+        for doc_id, data in records:
+            ids.append(doc_id)
+            amounts.append(data.get('amount') or 0.0)
+            day = data.get('date')
+            # Stored dates are already epoch days; only hand-built rows convert
+            if not isinstance(day, int):
+                day = to_epoch_day(day)
+            days.append(MISSING_DAY if day is None else day)
+            codes.append(category_index.setdefault(data.get('category'), len(category_index)))
+            descriptions.append(data.get('description'))
+        
+        return ExpenseColumns(
+            ids=ids,
+            amounts=np.array(amounts, dtype=np.float64),
+            days=np.array(days, dtype=np.int32),
+            category_codes=np.array(codes, dtype=np.int32),
+            categories=list(category_index),
+            descriptions=descriptions
+        )
+    
+    @staticmethod
+    def from_docs(docs):
+        return ExpenseColumns.from_records((doc.id, doc.to_dict()) for doc in docs)
+    
+    @staticmethod
+    def from_expenses(expenses):
+        return ExpenseColumns.from_records((expense.id, expense.to_dict()) for expense in expenses)
+    
+    def dated(self):
+        """Mask of rows that have a usable date"""
+        return self.days != MISSING_DAY
+    
+    def category_totals(self):
+        """Total amount per category name"""
+        totals = np.bincount(self.category_codes, weights=self.amounts, minlength=len(self.categories))
+        return dict(zip(self.categories, totals.tolist()))
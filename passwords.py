@@ -0,0 +1,55 @@
+import os
+import logging
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:1000000";
+# stored hashes made with other parameters are upgraded on the next login
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+# Hashes computed at once per worker; the hashes release the GIL, so this
+# caps the cores a burst of logins can take from other requests
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+# Hashes allowed to wait for a free slot before new ones are turned away
+PASSWORD_HASH_QUEUE = int(os.environ.get("PASSWORD_HASH_QUEUE", 8))
+# Seconds a request waits for its hash before giving up
+PASSWORD_HASH_TIMEOUT = float(os.environ.get("PASSWORD_HASH_TIMEOUT", 5))
+
+class PasswordHashBusy(Exception):
+    """Raised when too many password hashes are already running or queued"""
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+
+def _run_limited(fn, *args):
+    """Run fn in the hashing pool, failing fast when the pool is saturated"""
+    if not _slots.acquire(blocking=False):
+        logging.warning("Password hashing pool is saturated, rejecting request")
+        raise PasswordHashBusy()
+    future = _executor.submit(fn, *args)
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except TimeoutError:
+        # The slot is released once the abandoned hash finishes
+        future.cancel()
+        raise PasswordHashBusy()
+
+@functools.lru_cache(maxsize=None)
+def _method_prefix(method):
+    """The parameter prefix werkzeug writes for a method, with defaults filled in"""
+    return generate_password_hash('', method).split('$', 1)[0]
+
+def hash_password(password):
+    """Hash a password with the configured parameters"""
+    return _run_limited(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def check_password(stored_hash, password):
+    """Check a password against a stored hash"""
+    return _run_limited(check_password_hash, stored_hash, password)
+
+def needs_rehash(stored_hash):
+    """Whether a stored hash was made with other than the configured parameters"""
+    return stored_hash.split('$', 1)[0] != _method_prefix(PASSWORD_HASH_METHOD)
@@ -1,19 +1,50 @@
 import os
+import uuid
 import datetime
-import pandas as pd
-import json
 import io
 import csv
+import hashlib
+import itertools
 import logging
-from flask import render_template, request, redirect, url_for, jsonify, flash, session, Response
+from flask import render_template, request, redirect, url_for, jsonify, flash, session, Response, g
+from werkzeug.http import is_resource_modified
 from flask_login import login_user, logout_user, login_required, current_user
-from app import app, db, MockDB, get_user_by_email, create_user, verify_password
-from models import User, Expense
-from utils import generate_spending_tips, generate_category_chart, generate_trend_chart, get_expense_statistics
+from app import app, db, DocumentExistsError, PasswordHashBusy, get_user_by_email, create_user, verify_password, \
+    upgrade_password_hash
+from models import User, Expense, ExpenseColumns, format_day, to_epoch_day
+from utils import generate_spending_tips, get_expense_statistics, aggregate_category_totals, get_aggregate_statistics, \
+    generate_spending_tips_from_totals, cached_chart, category_chart_data, trend_chart_data, monthly_trend_chart_data, analyze_expenses
+from aggregates import get_user_aggregates, get_aggregate_details, get_monthly_rollups, record_expense_change, record_expense_changes
+from importer import import_expenses, parse_csv_rows, parse_json_rows
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 
+# Number of CSV rows sent per chunk by the streaming export
+EXPORT_CHUNK_ROWS = 500
+# Upload file extensions accepted by /import-expenses and their parsers
+IMPORT_PARSERS = {
+    '.csv': parse_csv_rows,
+    '.json': parse_json_rows,
+    '.jsonl': parse_json_rows,
+    '.ndjson': parse_json_rows,
+}
+
+# Charts served by /api/charts/<kind>
+CHART_KINDS = ('category', 'trend')
+TREND_PERIODS = ('week', 'month', 'year')
+
+# Expenses per page on the dashboard and /api/expenses
+EXPENSE_PAGE_SIZE = 20
+MAX_EXPENSE_PAGE_SIZE = 100
+
+# Most expense ids one /api/expenses/batch request may name
+MAX_BATCH_IDS = 1000
+BATCH_ACTIONS = ('delete', 'categorize')
+
+# Categories offered when adding, editing and recategorizing expenses
+EXPENSE_CATEGORIES = ['Food', 'Transport', 'Bills', 'Education', 'Entertainment', 'Shopping', 'Health', 'Misc']
+
 # Add current date to all templates
 @app.context_processor
 def inject_now():
@@ -46,13 +77,11 @@ def login():
             if is_registration:
                 logging.info(f"Registering new email user: {email}")
                 
-                # Check if user already exists
-                existing_user = get_user_by_email(email)
-                if existing_user:
+                # Create new user; duplicates are rejected atomically by the store
+                try:
+                    uid = create_user(email, password, display_name)
+                except DocumentExistsError:
                     return jsonify({'success': False, 'error': 'User already exists'}), 400
-                
-                # Create new user
-                uid = create_user(email, password, display_name)
             else:
                 # This is a login - verify the password
                 user_data = get_user_by_email(email)
@@ -60,6 +89,7 @@ def login():
                     return jsonify({'success': False, 'error': 'Invalid email or password'}), 401
                 
                 uid = user_data.get('id')
+                upgrade_password_hash(uid, user_data['passwordHash'], password)
                 display_name = user_data.get('displayName', email.split('@')[0])
             
             # Create User object and log them in
@@ -76,6 +106,11 @@ def login():
         else:
             return jsonify({'success': False, 'error': 'Missing authentication data'}), 400
     
+    except PasswordHashBusy:
+        # Turned away quickly so a login burst doesn't tie up every worker
+        response = jsonify({'success': False, 'error': 'Too many login attempts, please try again shortly'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
     except Exception as e:
         logging.error(f"Login error: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 401
@@ -116,7 +151,7 @@ def demo_login():
             session['is_demo'] = True
             session.permanent = False  # Session will expire when browser closes
             
-            # Create some demo expenses in memory
+            # Create some demo expenses, once
             logging.info("Creating demo expenses")
             expenses_collection = db.collection('expenses')
             
@@ -145,9 +180,16 @@ def demo_login():
                 }
             ]
             
-            # Add demo expenses
-            for expense in demo_expenses:
-                expenses_collection.add(expense)
+            # Fixed ids make seeding idempotent: the store persists across
+            # restarts, and concurrent demo logins can't both add a copy
+            for number, expense in enumerate(demo_expenses, 1):
+                batch = db.batch()
+                batch.create(expenses_collection.document(f"demo-expense-{number}"), expense)
+                record_expense_change(uid, new_expense=expense, batch=batch)
+                try:
+                    batch.commit()
+                except DocumentExistsError:
+                    continue
             
             # Flash a message to the user
             flash('Logged in as demo user for development purposes.', 'info')
@@ -182,104 +224,161 @@ def logout():
     
     return response
 
+def load_user_expenses(user_id, start_day=None, end_day=None, category=None):
+    """Load a user's expenses once per request, optionally scoped.
+    
+    Every consumer in the same request shares the columnar view, so the
+    store is queried and rows are deserialized only once. Day bounds are
+    inclusive epoch days and run as a range scan on the (user_id, date)
+    index, so a short range reads only the rows inside it.
+    """
+    loaded = g.setdefault('user_expenses', {})
+    key = (user_id, start_day, end_day, category)
+    if key not in loaded:
+        expenses_ref = db.collection('expenses').where('user_id', '==', user_id)
+        if start_day is not None:
+            expenses_ref = expenses_ref.where('date', '>=', start_day)
+        if end_day is not None:
+            expenses_ref = expenses_ref.where('date', '<=', end_day)
+        if category:
+            expenses_ref = expenses_ref.where('category', '==', category)
+        expenses_ref = expenses_ref.order_by('date', direction='DESCENDING')
+        loaded[key] = ExpenseColumns.from_docs(expenses_ref.stream())
+    return loaded[key]
+
+def parse_report_scope(args):
+    """Read the start_date, end_date and category report parameters.
+    
+    Returns keyword arguments for load_user_expenses; all None means the
+    whole history. Raises ValueError for malformed dates.
+    """
+    scope = {'start_day': None, 'end_day': None, 'category': args.get('category') or None}
+    for param, key in (('start_date', 'start_day'), ('end_date', 'end_day')):
+        if args.get(param):
+            scope[key] = to_epoch_day(args[param])
+            if scope[key] is None:
+                raise ValueError(f"{param} must be YYYY-MM-DD")
+    return scope
+
+def report_scope_args(scope):
+    """Query parameters that reproduce a report scope in generated URLs"""
+    args = {}
+    if scope['start_day'] is not None:
+        args['start_date'] = format_day(scope['start_day'])
+    if scope['end_day'] is not None:
+        args['end_date'] = format_day(scope['end_day'])
+    if scope['category']:
+        args['category'] = scope['category']
+    return args
+
+def encode_expense_cursor(doc):
+    """Keyset cursor for the position after an expense: '<epoch day>:<id>',
+    or 'none:<id>' for an undated one
+    """
+    day = doc.to_dict().get('date')
+    return f"{'none' if day is None else day}:{doc.id}"
+
+def decode_expense_cursor(cursor):
+    day, doc_id = cursor.split(':', 1)
+    return (None if day == 'none' else int(day)), doc_id
+
+def get_expense_page(user_id, cursor=None, page_size=EXPENSE_PAGE_SIZE):
+    """Get one page of a user's expenses, newest first, and the next cursor.
+    
+    Dated expenses are paged on the (user_id, date, id) index and undated
+    ones, which come last, with their own query once those run out, so
+    every page is an index range read.
+    """
+    day, doc_id = decode_expense_cursor(cursor) if cursor else (0, None)
+    expenses_ref = db.collection('expenses').where('user_id', '==', user_id)
+    
+    # Fetch one extra row to know whether another page exists
+    docs = []
+    if day is not None:
+        dated = expenses_ref.where('date', '!=', None).order_by('date', direction='DESCENDING')
+        if doc_id is not None:
+            dated = dated.start_after(day, doc_id)
+        docs = list(dated.limit(page_size + 1).stream())
+    if len(docs) <= page_size:
+        undated = expenses_ref.where('date', '==', None).order_by('date', direction='DESCENDING')
+        if day is None:
+            undated = undated.start_after(None, doc_id)
+        docs += undated.limit(page_size + 1 - len(docs)).stream()
+    next_cursor = encode_expense_cursor(docs[page_size - 1]) if len(docs) > page_size else None
+    
+    expenses = []
+    for doc in docs[:page_size]:
+        expense = Expense.from_dict(doc.id, doc.to_dict())
+        expenses.append({
+            'id': doc.id,
+            'amount': expense.amount,
+            'category': expense.category,
+            'date': format_day(expense.date),
+            'description': expense.description
+        })
+    return expenses, next_cursor
+
+@app.route('/api/expenses')
+@login_required
+def list_expenses():
+    """Keyset-paginated JSON listing of the current user's expenses"""
+    try:
+        page_size = min(int(request.args.get('limit', EXPENSE_PAGE_SIZE)), MAX_EXPENSE_PAGE_SIZE)
+        if page_size < 1:
+            raise ValueError("limit must be positive")
+        expenses, next_cursor = get_expense_page(current_user.id, request.args.get('cursor'), page_size)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Invalid page request: {e}'}), 400
+    
+    return jsonify({'success': True, 'expenses': expenses, 'next_cursor': next_cursor})
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
     # Get current date for filtering
     today = datetime.datetime.now().date()
     current_month_start = datetime.datetime(today.year, today.month, 1)
-
+    
     # Prepare empty data for fallback
     recent_expenses = []
-    all_expenses = []
     stats = {'total': 0, 'average_daily': 0, 'top_category': 'None', 'largest_expense': 0}
-    category_chart = None
+    has_charts = False
     tips = ['Start tracking your expenses to get personalized spending tips!']
     
-    # Query expenses for current month
     try:
-        # Check if we're in demo mode
-        if session.get('is_demo', False) and isinstance(db, MockDB):
+        if session.get('is_demo', False):
             logging.info("Using demo data for dashboard")
-            
-            # Get all expenses from mock DB
-            expenses_docs = db.collection('expenses').stream()
-            # Filter in memory for demo mode
-            filtered_expenses = []
-            
-            for doc in expenses_docs:
-                data = doc.to_dict()
-                if data.get('user_id') == current_user.id:
-                    filtered_expenses.append((doc.id, data))
-            
-            # Sort by date descending (in memory)
-            filtered_expenses.sort(key=lambda x: x[1].get('date', datetime.datetime.now()), reverse=True)
-            
-            # Get recent 5 expenses for display
-            for doc_id, expense_data in filtered_expenses[:5]:
-                expense = Expense.from_dict(doc_id, expense_data)
-                # Convert date to string format
-                if isinstance(expense.date, datetime.datetime):
-                    date_str = expense.date.strftime('%Y-%m-%d')
-                else:
-                    date_str = str(expense.date)
-                
-                recent_expenses.append({
-                    'id': doc_id,
-                    'amount': expense.amount,
-                    'category': expense.category,
-                    'date': date_str,
-                    'description': expense.description
-                })
-            
-            # Create expense objects for all expenses
-            all_expenses = [Expense.from_dict(doc_id, data) for doc_id, data in filtered_expenses]
-        else:
-            # Normal mode with Firestore - show all expenses without date limitation
-            expenses_ref = db.collection('expenses') \
-                .where('user_id', '==', current_user.id) \
-                .order_by('date', direction='DESCENDING')
-            
-            # Get all expenses for the user (no limit)
-            recent_expenses_docs = expenses_ref.stream()
-            
-            for doc in recent_expenses_docs:
-                expense_data = doc.to_dict()
-                expense = Expense.from_dict(doc.id, expense_data)
-                # Convert Firestore timestamp to datetime
-                if isinstance(expense.date, datetime.datetime):
-                    expense_data['date'] = expense.date.strftime('%Y-%m-%d')
-                recent_expenses.append({
-                    'id': doc.id,
-                    'amount': expense.amount,
-                    'category': expense.category,
-                    'date': expense_data['date'],
-                    'description': expense.description
-                })
-            
-            # Get expense statistics
-            all_expenses_docs = expenses_ref.stream()
-            all_expenses = [Expense.from_dict(doc.id, doc.to_dict()) for doc in all_expenses_docs]
         
-        # Only calculate stats and charts if we have expenses
-        if all_expenses:
-            # Generate statistics
-            stats = get_expense_statistics(all_expenses)
+        # Only the first page is rendered; dashboard.js loads the rest from
+        # /api/expenses as the user scrolls
+        recent_expenses, next_cursor = get_expense_page(current_user.id)
+        
+        # Stats, chart and tips come from the running aggregates, so they
+        # don't need to touch individual expenses
+        aggregates = get_user_aggregates(current_user.id, details=True)
+        
+        # Only calculate stats if we have expenses; the category chart is
+        # fetched from /api/charts after the page has rendered
+        if aggregates['count']:
+            category_totals = aggregate_category_totals(aggregates)
             
-            # Generate category chart
-            category_chart = generate_category_chart(all_expenses)
+            # Generate statistics
+            stats = get_aggregate_statistics(aggregates)
+            has_charts = True
             
             # Generate spending tips
-            tips = generate_spending_tips(all_expenses)
+            tips = generate_spending_tips_from_totals(category_totals)
         
         return render_template(
             'dashboard.html',
             recent_expenses=recent_expenses,
+            next_cursor=next_cursor,
             stats=stats,
-            category_chart=category_chart,
-            tips=tips
+            has_charts=has_charts,
+            tips=tips,
+            categories=EXPENSE_CATEGORIES
         )
-        
+    
     except Exception as e:
         logging.error(f"Dashboard error: {str(e)}")
         flash(f"Error loading dashboard: {str(e)}", "danger")
@@ -309,19 +408,19 @@ def add_expense():
                 description=description
             )
             
-            # Save to Firestore
-            db.collection('expenses').add(expense.to_dict())
+            # Save to Firestore, with the aggregates in the same write
+            batch = db.batch()
+            batch.create(db.collection('expenses').document(str(uuid.uuid4())), expense.to_dict())
+            record_expense_change(current_user.id, new_expense=expense.to_dict(), batch=batch)
+            batch.commit()
             
             flash('Expense added successfully!', 'success')
             return redirect(url_for('dashboard'))
-            
+        
         except Exception as e:
             flash(f'Error adding expense: {str(e)}', 'danger')
     
-    # Define expense categories
-    categories = ['Food', 'Transport', 'Bills', 'Education', 'Entertainment', 'Shopping', 'Health', 'Misc']
-    
-    return render_template('add_expense.html', categories=categories, today=datetime.date.today().strftime('%Y-%m-%d'))
+    return render_template('add_expense.html', categories=EXPENSE_CATEGORIES, today=datetime.date.today().strftime('%Y-%m-%d'))
 
 @app.route('/edit-expense/<expense_id>', methods=['GET', 'POST'])
 @login_required
@@ -351,27 +450,28 @@ def edit_expense(expense_id):
             date = datetime.datetime.strptime(date_str, '%Y-%m-%d')
             
             # Update expense
-            db.collection('expenses').document(expense_id).update({
+            changes = {
                 'amount': amount,
                 'category': category,
                 'date': date,
                 'description': description
-            })
+            }
+            batch = db.batch()
+            batch.update(db.collection('expenses').document(expense_id), changes)
+            record_expense_change(current_user.id, old_expense=expense_data, new_expense={**expense_data, **changes}, batch=batch)
+            batch.commit()
             
             flash('Expense updated successfully!', 'success')
             return redirect(url_for('dashboard'))
-            
+        
         except Exception as e:
             flash(f'Error updating expense: {str(e)}', 'danger')
     
     # Format date for the form
-    if isinstance(expense_data.get('date'), datetime.datetime):
-        expense_data['date'] = expense_data['date'].strftime('%Y-%m-%d')
+    expense_data['date'] = format_day(expense_data.get('date'))
     
-    # Define expense categories
-    categories = ['Food', 'Transport', 'Bills', 'Education', 'Entertainment', 'Shopping', 'Health', 'Misc']
-    
-    return render_template('edit_expense.html', expense=expense_data, expense_id=expense_id, categories=categories)
+    return render_template('edit_expense.html', expense=expense_data, expense_id=expense_id, categories=EXPENSE_CATEGORIES,
+                           formatted_date=expense_data['date'])
 
 @app.route('/delete-expense/<expense_id>', methods=['POST'])
 @login_required
@@ -390,50 +490,203 @@ def delete_expense(expense_id):
             return jsonify({'success': False, 'error': 'Permission denied'}), 403
         
         # Delete the expense
-        db.collection('expenses').document(expense_id).delete()
+        batch = db.batch()
+        batch.delete(db.collection('expenses').document(expense_id))
+        record_expense_change(current_user.id, old_expense=expense_data, batch=batch)
+        batch.commit()
         
         return jsonify({'success': True})
-        
+    
     except Exception as e:
         logging.error(f"Error deleting expense: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def find_batch_expenses(user_id, ids=None, filters=None):
+    """Look up the expenses a batch request targets in one store read.
+    
+    Returns (owned docs, ids that don't exist). Raises PermissionError if
+    any named id belongs to another user, so nothing is written.
+    """
+    expenses = db.collection('expenses')
+    if ids is not None:
+        docs = db.get_all([expenses.document(expense_id) for expense_id in dict.fromkeys(ids)])
+        if any(doc.exists and doc.to_dict().get('user_id') != user_id for doc in docs):
+            raise PermissionError("Permission denied")
+        return [doc for doc in docs if doc.exists], [doc.id for doc in docs if not doc.exists]
+    
+    query = expenses.where('user_id', '==', user_id)
+    for field, op, value in filters:
+        query = query.where(field, op, value)
+    return list(query.stream()), []
+
+def parse_batch_filter(raw_filter):
+    """Turn {start_date, end_date, category} into store where clauses"""
+    if not isinstance(raw_filter, dict):
+        raise ValueError("filter must be an object")
+    filters = []
+    for key, op in (('start_date', '>='), ('end_date', '<=')):
+        if raw_filter.get(key):
+            day = to_epoch_day(str(raw_filter[key]))
+            if day is None:
+                raise ValueError(f"{key} must be YYYY-MM-DD")
+            filters.append(('date', op, day))
+    if raw_filter.get('category'):
+        filters.append(('category', '==', str(raw_filter['category'])))
+    if not filters:
+        # An empty filter would match every expense the user has
+        raise ValueError("filter needs a start_date, end_date or category")
+    return filters
+
+@app.route('/api/expenses/batch', methods=['POST'])
+@login_required
+def batch_update_expenses():
+    """Delete or recategorize many expenses, chosen by ids or by a filter"""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'success': False, 'error': 'Expected a JSON object'}), 400
+    action = payload.get('action')
+    ids = payload.get('ids')
+    category = payload.get('category')
+    
+    try:
+        if action not in BATCH_ACTIONS:
+            raise ValueError(f"action must be one of {', '.join(BATCH_ACTIONS)}")
+        if action == 'categorize' and (not isinstance(category, str) or not category.strip()):
+            raise ValueError("categorize needs a category")
+        if (ids is None) == (payload.get('filter') is None):
+            raise ValueError("Pass either ids or filter")
+        if ids is not None:
+            if not isinstance(ids, list) or not all(isinstance(expense_id, str) for expense_id in ids):
+                raise ValueError("ids must be a list of expense ids")
+            if len(ids) > MAX_BATCH_IDS:
+                raise ValueError(f"At most {MAX_BATCH_IDS} ids per request")
+            filters = None
+        else:
+            filters = parse_batch_filter(payload['filter'])
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    try:
+        docs, missing = find_batch_expenses(current_user.id, ids, filters)
+    except PermissionError:
+        return jsonify({'success': False, 'error': 'Permission denied'}), 403
+    
+    try:
+        batch = db.batch()
+        changes = []
+        for doc in docs:
+            old_expense = doc.to_dict()
+            if action == 'delete':
+                batch.delete(doc)
+                changes.append((old_expense, None))
+            else:
+                batch.update(doc, {'category': category.strip()})
+                changes.append((old_expense, {**old_expense, 'category': category.strip()}))
+        if changes:
+            record_expense_changes(current_user.id, changes, batch=batch)
+            batch.commit()
+    except Exception as e:
+        logging.error(f"Batch {action} error: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    return jsonify({'success': True, 'action': action, 'count': len(changes), 'missing': missing})
+
 @app.route('/reports')
 @login_required
 def reports():
+    period = request.args.get('period', 'month')
+    if period not in TREND_PERIODS:
+        period = 'month'
+    
     try:
-        # Get all expenses for the user
-        expenses_ref = db.collection('expenses') \
-            .where('user_id', '==', current_user.id) \
-            .order_by('date', direction='DESCENDING')
-        
-        expenses_docs = expenses_ref.stream()
-        all_expenses = [Expense.from_dict(doc.id, doc.to_dict()) for doc in expenses_docs]
-        
-        # Generate category chart
-        category_chart = generate_category_chart(all_expenses)
-        
-        # Generate trend chart
-        trend_chart = generate_trend_chart(all_expenses)
-        
-        # Get expense statistics
-        stats = get_expense_statistics(all_expenses)
-        
-        # Generate spending tips
-        tips = generate_spending_tips(all_expenses)
+        scope = parse_report_scope(request.args)
+    except ValueError as e:
+        flash(f"Invalid report filter: {str(e)}", "warning")
+        return redirect(url_for('reports', period=period))
+    
+    try:
+        scope_args = report_scope_args(scope)
+        if scope_args:
+            # A scoped report reads only the matching rows
+            analysis = analyze_expenses(load_user_expenses(current_user.id, **scope), period)
+            stats = get_expense_statistics(analysis)
+            tips = generate_spending_tips(analysis)
+            expense_count = analysis['count']
+        else:
+            aggregates = get_user_aggregates(current_user.id, details=True)
+            category_totals = aggregate_category_totals(aggregates)
+            
+            # Get expense statistics
+            stats = get_aggregate_statistics(aggregates)
+            
+            # Generate spending tips
+            tips = generate_spending_tips_from_totals(category_totals) if aggregates['count'] else generate_spending_tips([])
+            expense_count = aggregates['count']
         
+        # Charts are fetched from /api/charts after the page has rendered
         return render_template(
             'reports.html',
-            category_chart=category_chart,
-            trend_chart=trend_chart,
+            has_charts=expense_count > 0,
+            period=period,
+            scope_args=scope_args,
+            categories=EXPENSE_CATEGORIES,
+            last_30_days=(datetime.date.today() - datetime.timedelta(days=29)).isoformat(),
             stats=stats,
             tips=tips
         )
-        
+    
     except Exception as e:
         logging.error(f"Reports error: {str(e)}")
         flash(f"Error generating reports: {str(e)}", "danger")
-        return render_template('reports.html', error=str(e))
+        return render_template('reports.html', error=str(e), period=period, scope_args={}, categories=EXPENSE_CATEGORIES)
+
+@app.route('/api/charts/<kind>')
+@login_required
+def chart_data(kind):
+    """Chart JSON for the dashboard and reports, with conditional GET support"""
+    if kind not in CHART_KINDS:
+        return jsonify({'success': False, 'error': 'Unknown chart'}), 404
+    
+    period = request.args.get('period', 'month') if kind == 'trend' else None
+    if kind == 'trend' and period not in TREND_PERIODS:
+        return jsonify({'success': False, 'error': 'Invalid period'}), 400
+    
+    try:
+        scope = parse_report_scope(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    scope_key = '|'.join(f"{key}={value}" for key, value in sorted(report_scope_args(scope).items()))
+    
+    # The data version identifies the chart contents, so unchanged charts
+    # are answered with a 304 before anything is built
+    aggregates = get_user_aggregates(current_user.id)
+    # The scope is hashed since raw parameters may hold characters an ETag can't
+    scope_hash = hashlib.sha1(scope_key.encode()).hexdigest()[:12]
+    etag = f"{aggregates['version']}-{kind}-{period}-{scope_hash}"
+    last_modified = datetime.datetime.fromtimestamp(int(aggregates['updated_at']), datetime.timezone.utc)
+    
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        # Only the numbers are sent; layout and styling live in the client
+        if kind == 'category' and not scope_key:
+            build = lambda: category_chart_data(aggregate_category_totals(get_aggregate_details(current_user.id)))
+        elif kind == 'category':
+            build = lambda: category_chart_data(load_user_expenses(current_user.id, **scope).category_totals())
+        elif period == 'year' and scope['start_day'] is None and scope['end_day'] is None:
+            # Whole months over the whole history come straight from the rollups
+            build = lambda: monthly_trend_chart_data(get_monthly_rollups(current_user.id, scope['category']))
+        else:
+            build = lambda: trend_chart_data(load_user_expenses(current_user.id, **scope), period)
+        chart = cached_chart(current_user.id, kind, period, aggregates['version'], build, scope=scope_key)
+        response = Response(chart or 'null', mimetype='application/json')
+    
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # Let browsers keep the chart but revalidate it on every view
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 @app.route('/export-expenses')
 @login_required
@@ -444,35 +697,40 @@ def export_expenses():
             .where('user_id', '==', current_user.id) \
             .order_by('date', direction='DESCENDING')
         
-        expenses_docs = expenses_ref.stream()
-        
-        # Create a DataFrame
-        data = []
-        for doc in expenses_docs:
-            expense = doc.to_dict()
-            # Convert date to string if it's a datetime
-            if isinstance(expense.get('date'), datetime.datetime):
-                expense['date'] = expense['date'].strftime('%Y-%m-%d')
-            data.append({
-                'Date': expense.get('date'),
-                'Category': expense.get('category'),
-                'Amount': expense.get('amount'),
-                'Description': expense.get('description', '')
-            })
+        expenses_docs = iter(expenses_ref.stream())
         
-        if not data:
+        # Peek at the first row so an empty export can still redirect
+        first_doc = next(expenses_docs, None)
+        if first_doc is None:
             flash('No expenses to export', 'warning')
             return redirect(url_for('reports'))
         
-        df = pd.DataFrame(data)
-        
-        # Create CSV in memory
-        csv_data = io.StringIO()
-        df.to_csv(csv_data, index=False)
+        def generate_csv():
+            # Rows are written through a small reusable buffer and sent in
+            # chunks, so memory stays flat however long the history is
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, lineterminator='\n')
+            writer.writerow(['Date', 'Category', 'Amount', 'Description'])
+            
+            for row_count, doc in enumerate(itertools.chain([first_doc], expenses_docs), 1):
+                expense = doc.to_dict()
+                writer.writerow([
+                    format_day(expense.get('date')),
+                    expense.get('category'),
+                    expense.get('amount'),
+                    expense.get('description', '')
+                ])
+                
+                if row_count % EXPORT_CHUNK_ROWS == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            
+            yield buffer.getvalue()
         
-        # Create response with CSV file
+        # Stream the CSV; without a Content-Length the server uses chunked transfer
         response = Response(
-            csv_data.getvalue(),
+            generate_csv(),
             mimetype='text/csv',
             headers={
                 'Content-Disposition': 'attachment; filename=expenses.csv',
@@ -481,23 +739,48 @@ def export_expenses():
         )
         
         return response
-        
+    
     except Exception as e:
         logging.error(f"Export error: {str(e)}")
         flash(f"Error exporting expenses: {str(e)}", "danger")
         return redirect(url_for('reports'))
+
+@app.route('/import-expenses', methods=['POST'])
+@login_required
+def bulk_import_expenses():
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({'success': False, 'error': 'No file uploaded'}), 400
+    
+    extension = os.path.splitext(upload.filename)[1].lower()
+    parse_rows = IMPORT_PARSERS.get(extension)
+    if parse_rows is None:
+        return jsonify({'success': False, 'error': 'Upload a .csv, .json or .jsonl file'}), 400
+    
+    try:
+        # Rows are parsed from the upload as they are written, never all at once
+        result = import_expenses(current_user.id, parse_rows(upload.stream))
+    except Exception as e:
+        logging.error(f"Import error: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    logging.info(f"Imported {result['imported']} expenses for user {current_user.id}, rejected {result['rejected']}")
+    if 'error' in result:
+        return jsonify({'success': False, **result}), 400
+    return jsonify({'success': True, **result})
+
 @app.route('/reset-password', methods=['POST'])
 def reset_password():
     try:
         email = request.json.get('email')
         if not email:
             return jsonify({'success': False, 'error': 'Email is required'}), 400
-            
+        
         user = get_user_by_email(email)
         if not user:
             # Don't reveal if user exists
             return jsonify({'success': True})
-            
+        
         # In a real app, you would:
         # 1. Generate a reset token
         # 2. Save it to the database with an expiration
@@ -505,7 +788,7 @@ def reset_password():
         
         # For demo, we'll just return success
         return jsonify({'success': True})
-        
+    
     except Exception as e:
         logging.error(f"Password reset error: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -0,0 +1,721 @@
+import uuid
+import logging
+import itertools
+import threading
+import contextlib
+
+from sqlalchemy import (
+    JSON, Column, DateTime, Float, Index, Integer, MetaData, String, Table, Text,
+    and_, create_engine, event, func, inspect, or_, select, insert, update, delete, text, tuple_
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from app import DocumentExistsError, Increment, NORMALIZERS, merge_values
+from instrumentation import timed
+from models import to_epoch_day
+
+metadata = MetaData()
+
+# Rows fetched per round-trip when streaming query results
+STREAM_BATCH_SIZE = 500
+
+# Known collections get real columns so filters, sorts and unique keys run in
+# the database. Fields without a column are kept in the JSON 'extra' column.
+TABLES = {
+    'expenses': Table(
+        'expenses', metadata,
+        Column('id', String(64), primary_key=True),
+        Column('user_id', String(255), nullable=False),
+        Column('amount', Float),
+        Column('category', String(64)),
+        # Days since the Unix epoch, see models.to_epoch_day
+        Column('date', Integer),
+        Column('description', Text),
+        Column('extra', JSON),
+        # id last, so keyset pages on (date, id) are one index range seek
+        Index('ix_expenses_user_id_date_id', 'user_id', 'date', 'id'),
+        Index('ix_expenses_user_id_amount', 'user_id', 'amount'),
+    ),
+    'users': Table(
+        'users', metadata,
+        Column('id', String(255), primary_key=True),
+        Column('email', String(255), unique=True),
+        Column('displayName', String(255)),
+        Column('passwordHash', String(512)),
+        Column('createdAt', DateTime),
+        Column('extra', JSON),
+    ),
+    # Per-user expense totals, see aggregates.py
+    'expense_stats': Table(
+        'expense_stats', metadata,
+        Column('id', String(255), primary_key=True),
+        Column('user_id', String(255)),
+        Column('count', Integer),
+        Column('total', Float),
+        Column('version', String(64)),
+        Column('updated_at', Float),
+        Column('extra', JSON),
+    ),
+    # Per-user counts and totals by category and by day, see aggregates.py
+    'expense_counts': Table(
+        'expense_counts', metadata,
+        Column('id', String(512), primary_key=True),
+        Column('user_id', String(255), nullable=False),
+        Column('kind', String(16)),
+        Column('key', String(64)),
+        Column('count', Integer),
+        Column('total', Float),
+        Column('extra', JSON),
+        Index('ix_expense_counts_user_id_kind', 'user_id', 'kind'),
+    ),
+    # Per-user, per-month, per-category totals, see aggregates.py
+    'expense_rollups': Table(
+        'expense_rollups', metadata,
+        Column('id', String(512), primary_key=True),
+        Column('user_id', String(255), nullable=False),
+        # Months since January 1970, see models.to_epoch_month
+        Column('month', Integer),
+        Column('category', String(64)),
+        Column('count', Integer),
+        Column('total', Float),
+        Column('extra', JSON),
+        Index('ix_expense_rollups_user_id_month', 'user_id', 'month'),
+    ),
+}
+
+# Indexes since replaced by others in TABLES, dropped at startup
+OUTDATED_INDEXES = ('ix_expenses_user_id_date',)
+
+# Tables holding only data derived from the expenses, which aggregates.py
+# rebuilds on first read, so they can be dropped when their columns change
+DERIVED_TABLES = ('expense_stats', 'expense_counts', 'expense_rollups')
+
+# PostgreSQL advisory lock key held while the schema is checked or changed
+SCHEMA_LOCK_KEY = 7_001_004
+
+# Dialects with INSERT ... ON CONFLICT, used for merge writes
+UPSERT_INSERTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+# Firestore-style operators mapped to SQLAlchemy column expressions
+OPERATORS = {
+    '==': lambda column, value: column.is_(None) if value is None else column == value,
+    '!=': lambda column, value: column.is_not(None) if value is None else column != value,
+    '<': lambda column, value: column < value,
+    '<=': lambda column, value: column <= value,
+    '>': lambda column, value: column > value,
+    '>=': lambda column, value: column >= value,
+    'in': lambda column, value: column.in_(list(value)),
+    'not-in': lambda column, value: column.not_in(list(value)),
+}
+
+def normalize_database_url(url):
+    """Accept the postgres:// scheme some hosts still hand out"""
+    if url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+class SQLDB:
+    """SQLAlchemy-backed store exposing the same API as MockDB"""
+    
+    def __init__(self, url):
+        url = normalize_database_url(url)
+        if url.startswith('sqlite'):
+            self.engine = create_engine(url, connect_args={'timeout': 30})
+            event.listen(self.engine, 'connect', _configure_sqlite)
+        else:
+            self.engine = create_engine(
+                url,
+                pool_size=5,
+                max_overflow=10,
+                pool_pre_ping=True,
+                pool_recycle=300
+            )
+        self.collections = {}
+        # The connection of this thread's open transaction, see transaction()
+        self._local = threading.local()
+        with self._schema_transaction() as connection:
+            self._migrate_expense_dates(connection)
+            self._drop_outdated_derived_tables(connection)
+            metadata.create_all(connection)
+            for name in OUTDATED_INDEXES:
+                connection.execute(text(f'DROP INDEX IF EXISTS {name}'))
+            # create_all skips existing tables, so add indexes introduced since
+            for table in TABLES.values():
+                for index in table.indexes:
+                    index.create(connection, checkfirst=True)
+        logging.info("Using SQL database: %s", self.engine.url.render_as_string(hide_password=True))
+    
+    def _migrate_expense_dates(self, connection):
+        """Convert a legacy expenses table with DateTime dates to epoch days, once.
+        
+        Done in place (add a column, backfill it, drop the old one and
+        rename), so the table keeps its primary key and constraint names.
+        Runs in the schema transaction, so the first worker to start does
+        it and the rest find the Integer column.
+        """
+        inspector = inspect(connection)
+        if not inspector.has_table('expenses'):
+            return
+        columns = {column['name']: column['type'] for column in inspector.get_columns('expenses')}
+        if isinstance(columns['date'], Integer):
+            return
+        
+        logging.warning("Migrating expense dates to epoch days")
+        legacy = Table('expenses', MetaData(), autoload_with=connection)
+        # Indexes on the old column would block dropping it; the new one
+        # is created again once the migration is done
+        connection.execute(text('DROP INDEX IF EXISTS ix_expenses_user_id_date'))
+        # Left behind by an interrupted run on a database without transactional DDL
+        if 'date_day' not in columns:
+            connection.execute(text('ALTER TABLE expenses ADD COLUMN date_day INTEGER'))
+        backfill = text('UPDATE expenses SET date_day = :day WHERE id = :row_id')
+        last_id = None
+        while True:
+            page = select(legacy.c.id, legacy.c.date).order_by(legacy.c.id).limit(STREAM_BATCH_SIZE)
+            if last_id is not None:
+                page = page.where(legacy.c.id > last_id)
+            rows = connection.execute(page).all()
+            if not rows:
+                break
+            connection.execute(backfill, [{'row_id': row_id, 'day': to_epoch_day(date)} for row_id, date in rows])
+            last_id = rows[-1][0]
+        connection.execute(text('ALTER TABLE expenses DROP COLUMN date'))
+        connection.execute(text('ALTER TABLE expenses RENAME COLUMN date_day TO date'))
+    
+    @contextlib.contextmanager
+    def _schema_transaction(self):
+        """A transaction only one process at a time can be in, for schema changes.
+        
+        Workers starting together would otherwise all find a table missing
+        and all try to create it. PostgreSQL takes an advisory lock and
+        SQLite the database write lock; both keep DDL in the transaction.
+        """
+        with self.engine.connect() as connection:
+            if connection.dialect.name == 'postgresql':
+                connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': SCHEMA_LOCK_KEY})
+            elif connection.dialect.name == 'sqlite':
+                connection.exec_driver_sql('BEGIN IMMEDIATE')
+            yield connection
+            connection.commit()
+    
+    def _drop_outdated_derived_tables(self, connection):
+        """Drop the derived tables if any has other columns than TABLES defines"""
+        inspector = inspect(connection)
+        outdated = [
+            name for name in DERIVED_TABLES
+            if inspector.has_table(name)
+            and {column['name'] for column in inspector.get_columns(name)} != set(TABLES[name].columns.keys())
+        ]
+        if not outdated:
+            return
+        
+        # Dropping every derived table at once keeps them consistent with
+        # each other; the missing stats make each user rebuild on next read
+        logging.warning(f"Dropping outdated derived tables {', '.join(outdated)}")
+        for name in DERIVED_TABLES:
+            connection.execute(text(f'DROP TABLE IF EXISTS {name}'))
+    
+    def _connect(self):
+        """Connection for reads: the thread's open transaction, or a new one"""
+        connection = getattr(self._local, 'connection', None)
+        return contextlib.nullcontext(connection) if connection is not None else self.engine.connect()
+    
+    def _begin(self):
+        """Connection for writes, committed with the thread's open transaction if any"""
+        connection = getattr(self._local, 'connection', None)
+        return contextlib.nullcontext(connection) if connection is not None else self.engine.begin()
+    
+    @contextlib.contextmanager
+    def transaction(self, doc):
+        """Run the block's reads and writes in one transaction holding a write lock on doc.
+        
+        Writes to the document from elsewhere wait until the block ends, so
+        a block that reads, computes and writes back can't lose an update
+        made in between. A missing document is created empty to be locked.
+        """
+        if getattr(self._local, 'connection', None) is not None:
+            raise RuntimeError("Transactions can't be nested")
+        with self.engine.begin() as connection:
+            doc._lock(connection)
+            self._local.connection = connection
+            try:
+                yield
+            finally:
+                self._local.connection = None
+    
+    def collection(self, name):
+        if name not in self.collections:
+            table = TABLES.get(name)
+            if table is None:
+                # Ad-hoc collections store everything in the JSON column
+                table = Table(
+                    name, metadata,
+                    Column('id', String(255), primary_key=True),
+                    Column('extra', JSON),
+                    extend_existing=True
+                )
+                with self._schema_transaction() as connection:
+                    table.create(connection, checkfirst=True)
+            self.collections[name] = SQLCollection(self, name, table)
+        return self.collections[name]
+    
+    def batch(self):
+        return SQLWriteBatch(self)
+    
+    @timed('storage')
+    def get_all(self, docs):
+        """Fetch several documents at once, in the order given.
+        
+        Reads each collection with one SELECT ... WHERE id IN per
+        STREAM_BATCH_SIZE ids instead of one query per document.
+        """
+        docs = list(docs)
+        rows = {}
+        with self._connect() as connection:
+            by_collection = sorted(docs, key=lambda doc: doc.collection.name)
+            for collection, group in itertools.groupby(by_collection, key=lambda doc: doc.collection):
+                table = collection.table
+                ids = list({doc.id for doc in group})
+                for start in range(0, len(ids), STREAM_BATCH_SIZE):
+                    for row in connection.execute(select(table).where(table.c.id.in_(ids[start:start + STREAM_BATCH_SIZE]))):
+                        rows[(collection.name, row._mapping['id'])] = collection._from_row(row)
+        for doc in docs:
+            data = rows.get((doc.collection.name, doc.id))
+            doc.exists = data is not None
+            doc._data = dict(data) if data is not None else {}
+        return docs
+
+def _configure_sqlite(dbapi_connection, connection_record):
+    # WAL lets several gunicorn workers read while one writes
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+class SQLCollection:
+    def __init__(self, db, name, table):
+        self.db = db
+        self.name = name
+        self.table = table
+        self.fields = {column.name for column in table.columns} - {'id', 'extra'}
+        self.normalize = NORMALIZERS.get(name) or dict
+    
+    def document(self, doc_id):
+        return SQLDocument(self, doc_id)
+    
+    def where(self, field, op, value):
+        return SQLQuery(self).where(field, op, value)
+    
+    def order_by(self, field, direction='asc'):
+        return SQLQuery(self).order_by(field, direction)
+    
+    def limit(self, limit_value):
+        return SQLQuery(self).limit(limit_value)
+    
+    def stream(self):
+        return SQLQuery(self).stream()
+    
+    def add(self, data):
+        doc = self.document(str(uuid.uuid4()))
+        doc.create(data)
+        return doc
+    
+    def _to_row(self, data):
+        """Split document data into column values and the JSON extra field"""
+        row = {field: data.get(field) for field in self.fields}
+        extra = {key: value for key, value in data.items() if key not in self.fields}
+        row['extra'] = extra or None
+        return row
+    
+    def _from_row(self, row):
+        mapping = row._mapping
+        data = {field: mapping[field] for field in self.fields}
+        if mapping['extra']:
+            data.update(mapping['extra'])
+        return data
+
+class SQLQuery:
+    """Chainable query compiled to a single SELECT"""
+    
+    def __init__(self, collection):
+        self.collection = collection
+        self.filters = []
+        self.order_fields = []
+        # Fields a filter already keeps non-null
+        self.not_null = set()
+        # Fields an equality filter pins to one value
+        self.constant = set()
+        self.limit_value = None
+    
+    def _copy(self):
+        query = SQLQuery(self.collection)
+        query.filters = list(self.filters)
+        query.order_fields = list(self.order_fields)
+        query.not_null = set(self.not_null)
+        query.constant = set(self.constant)
+        query.limit_value = self.limit_value
+        return query
+    
+    def _column(self, field):
+        if field not in self.collection.fields:
+            raise ValueError(f"{self.collection.name} has no indexed field {field!r}")
+        return self.collection.table.c[field]
+    
+    def where(self, field, op, value):
+        if op not in OPERATORS:
+            raise ValueError(f"Unsupported query operator: {op}")
+        query = self._copy()
+        query.filters.append(OPERATORS[op](self._column(field), value))
+        if op in ('<', '<=', '>', '>=') or (op == '==') != (value is None):
+            query.not_null.add(field)
+        if op == '==':
+            query.constant.add(field)
+        return query
+    
+    def order_by(self, field, direction='asc'):
+        query = self._copy()
+        column = self._column(field)
+        descending = str(direction).lower() in ('desc', 'descending')
+        query.order_fields.append((column, descending))
+        return query
+    
+    def start_after(self, value, doc_id):
+        """Resume a single-key ordered query after the (value, doc id) cursor.
+        
+        A None value puts the cursor among the rows missing the field. When
+        a filter keeps the field non-null the cursor is a single row value
+        comparison, which an index on (..., field, id) serves as one seek.
+        """
+        if len(self.order_fields) != 1:
+            raise ValueError("start_after requires exactly one order_by field")
+        column, descending = self.order_fields[0]
+        id_column = self.collection.table.c.id
+        query = self._copy()
+        key, cursor = tuple_(column, id_column), tuple_(value, doc_id)
+        # Rows missing the field sort last, by id in the same direction
+        if value is None:
+            after_id = id_column < doc_id if descending else id_column > doc_id
+            query.filters.append(after_id if column.name in self.constant else and_(column.is_(None), after_id))
+        elif column.name in self.not_null:
+            query.filters.append(key < cursor if descending else key > cursor)
+        else:
+            query.filters.append(or_(key < cursor if descending else key > cursor, column.is_(None)))
+        return query
+    
+    def limit(self, limit_value):
+        query = self._copy()
+        query.limit_value = limit_value
+        return query
+    
+    def _statement(self):
+        statement = select(self.collection.table)
+        if self.filters:
+            statement = statement.where(*self.filters)
+        if self.order_fields:
+            orders = []
+            for column, descending in self.order_fields:
+                # A field an equality filter pins needs no ordering
+                if column.name in self.constant:
+                    continue
+                # Rows missing the field sort last in both directions, as in
+                # MockDB; skipped when a filter rules them out, so the order
+                # can be read straight off an index
+                if column.name not in self.not_null:
+                    orders.append(column.is_(None))
+                orders.append(column.desc() if descending else column.asc())
+            # Break ties on the last key by id so keyset pages are stable
+            id_column = self.collection.table.c.id
+            descending = self.order_fields[-1][1]
+            statement = statement.order_by(*orders, id_column.desc() if descending else id_column.asc())
+        if self.limit_value is not None:
+            statement = statement.limit(self.limit_value)
+        return statement
+    
+    @timed('storage')
+    def stream(self):
+        """Yield matching documents, fetching rows from the cursor in batches"""
+        with self.collection.db._connect() as connection:
+            result = connection.execute(self._statement().execution_options(yield_per=STREAM_BATCH_SIZE))
+            for row in result:
+                yield SQLDocument(self.collection, row._mapping['id'], self.collection._from_row(row))
+    
+    @timed('storage')
+    def count(self):
+        """Number of matching documents, counted in the database"""
+        statement = select(func.count()).select_from(self._statement().subquery())
+        with self.collection.db._connect() as connection:
+            return connection.execute(statement).scalar()
+
+class SQLDocument:
+    def __init__(self, collection, id, data=None):
+        self.collection = collection
+        self.id = id
+        self._data = data or {}
+        self.exists = data is not None
+    
+    @property
+    def _table(self):
+        return self.collection.table
+    
+    @timed('storage')
+    def get(self):
+        with self.collection.db._connect() as connection:
+            row = connection.execute(
+                select(self._table).where(self._table.c.id == self.id)
+            ).first()
+        self.exists = row is not None
+        self._data = self.collection._from_row(row) if row is not None else {}
+        return self
+    
+    def _insert(self, connection, data):
+        connection.execute(insert(self._table).values(id=self.id, **self.collection._to_row(data)))
+    
+    def _set(self, connection, data):
+        row = self.collection._to_row(data)
+        result = connection.execute(update(self._table).where(self._table.c.id == self.id).values(**row))
+        if result.rowcount == 0:
+            connection.execute(insert(self._table).values(id=self.id, **row))
+    
+    def _update(self, connection, data):
+        table = self._table
+        values = {key: value for key, value in data.items() if key in self.collection.fields}
+        extra = {key: value for key, value in data.items() if key not in self.collection.fields}
+        if extra:
+            current = connection.execute(
+                select(table.c.extra).where(table.c.id == self.id)
+            ).scalar()
+            values['extra'] = {**(current or {}), **extra}
+        if values:
+            connection.execute(update(table).where(table.c.id == self.id).values(**values))
+    
+    def _lock(self, connection):
+        """Take a write lock on the document's row, creating it empty if missing"""
+        # A write rather than SELECT ... FOR UPDATE, which SQLite ignores:
+        # it locks the row, or on SQLite the whole database, before the
+        # transaction reads anything
+        table = self._table
+        upsert = UPSERT_INSERTS.get(connection.dialect.name)
+        if upsert is not None:
+            statement = upsert(table).values(id=self.id)
+            connection.execute(statement.on_conflict_do_update(index_elements=[table.c.id], set_={'id': statement.excluded.id}))
+        elif connection.execute(update(table).where(table.c.id == self.id).values(id=table.c.id)).rowcount == 0:
+            self._insert(connection, {})
+    
+    def _merge(self, connection, data):
+        """Update or create the document, adding Increment values to the stored ones"""
+        if _can_upsert(connection, self.collection, [(self, data)]):
+            _upsert(connection, self.collection, [(self, data)])
+            return
+        # Without ON CONFLICT, lock the row so no other write lands in between
+        table = self._table
+        row = connection.execute(select(table).where(table.c.id == self.id).with_for_update()).first()
+        if row is None:
+            self._insert(connection, merge_values({}, data))
+        else:
+            merged = merge_values(self.collection._from_row(row), data)
+            connection.execute(update(table).where(table.c.id == self.id).values(**self.collection._to_row(merged)))
+    
+    def _merged(self, data):
+        """Refresh the cached data after a merge; incremented fields are unknown"""
+        self._data = {
+            **{key: value for key, value in self._data.items() if key not in data},
+            **{key: value for key, value in data.items() if not isinstance(value, Increment)}
+        }
+        self.exists = True
+    
+    def _conflict(self):
+        return DocumentExistsError(f"{self.collection.name}: {self.id} conflicts with an existing document")
+    
+    @timed('storage')
+    def create(self, data):
+        """Write the document only if it doesn't exist yet"""
+        data = self.collection.normalize(data)
+        try:
+            with self.collection.db._begin() as connection:
+                self._insert(connection, data)
+        except IntegrityError as e:
+            raise self._conflict() from e
+        self._data = dict(data)
+        self.exists = True
+        return True
+    
+    @timed('storage')
+    def set(self, data, merge=False):
+        """Replace the document; with merge=True update or create it instead.
+        
+        Increment values in merged data are applied by the database.
+        """
+        data = self.collection.normalize(data)
+        try:
+            with self.collection.db._begin() as connection:
+                if merge:
+                    self._merge(connection, data)
+                else:
+                    self._set(connection, data)
+        except IntegrityError as e:
+            raise self._conflict() from e
+        if merge:
+            self._merged(data)
+        else:
+            self._data = dict(data)
+            self.exists = True
+        return True
+    
+    @timed('storage')
+    def update(self, data):
+        data = self.collection.normalize(data)
+        with self.collection.db._begin() as connection:
+            self._update(connection, data)
+        self._data.update(data)
+        return True
+    
+    @timed('storage')
+    def delete(self):
+        with self.collection.db._begin() as connection:
+            connection.execute(delete(self._table).where(self._table.c.id == self.id))
+        self._data = {}
+        self.exists = False
+        return True
+    
+    def to_dict(self):
+        return dict(self._data)
+
+def _same_column_values(collection, run):
+    """Whether a run of (doc, data) updates writes identical column-only data"""
+    data = run[0][1]
+    return bool(data) and data.keys() <= collection.fields and all(other == data for _, other in run)
+
+def _can_upsert(connection, collection, run):
+    """Whether a run of (doc, data) merges can go out as one INSERT ... ON CONFLICT.
+    
+    Needs a dialect that has it, data only for real columns, the same
+    fields and increments in every write and each document at most once.
+    """
+    if connection.dialect.name not in UPSERT_INSERTS:
+        return False
+    data = run[0][1]
+    shape = {key: isinstance(value, Increment) for key, value in data.items()}
+    return (
+        data.keys() <= collection.fields
+        and all({key: isinstance(value, Increment) for key, value in other.items()} == shape for _, other in run)
+        and len({doc.id for doc, _ in run}) == len(run)
+    )
+
+def _upsert(connection, collection, run):
+    """Merge a run of (doc, data) writes that passed _can_upsert"""
+    table = collection.table
+    statement = UPSERT_INSERTS[connection.dialect.name](table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.id],
+        set_={
+            key: func.coalesce(table.c[key], 0) + statement.excluded[key] if isinstance(value, Increment) else statement.excluded[key]
+            for key, value in run[0][1].items()
+        }
+    )
+    rows = [
+        {'id': doc.id, **{key: value.value if isinstance(value, Increment) else value for key, value in data.items()}}
+        for doc, data in run
+    ]
+    for start in range(0, len(rows), STREAM_BATCH_SIZE):
+        connection.execute(statement, rows[start:start + STREAM_BATCH_SIZE])
+
+class SQLWriteBatch:
+    """Writes applied in one transaction on commit, like a Firestore WriteBatch.
+    
+    Runs of creates or deletes on the same table go out as multi-row
+    statements instead of one statement per document.
+    """
+    
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+    
+    def create(self, doc, data):
+        self.writes.append(('create', doc, data))
+        return self
+    
+    def set(self, doc, data, merge=False):
+        self.writes.append(('merge' if merge else 'set', doc, data))
+        return self
+    
+    def update(self, doc, data):
+        self.writes.append(('update', doc, data))
+        return self
+    
+    def delete(self, doc):
+        self.writes.append(('delete', doc, None))
+        return self
+    
+    def delete_if(self, doc, field, op, value):
+        """Delete the document if, after the writes before this one, field op value holds"""
+        self.writes.append(('delete_if', doc, (field, op, value)))
+        return self
+    
+    def __len__(self):
+        return len(self.writes)
+    
+    @timed('storage')
+    def commit(self):
+        # (doc, data after the write) applied to the references once committed
+        written = []
+        try:
+            with self.db._begin() as connection:
+                runs = itertools.groupby(self.writes, key=lambda write: (write[0], write[1].collection))
+                for (op, collection), run in runs:
+                    run = [(doc, data if op in ('delete', 'delete_if') else collection.normalize(data)) for _, doc, data in run]
+                    table = collection.table
+                    if op == 'create':
+                        for start in range(0, len(run), STREAM_BATCH_SIZE):
+                            connection.execute(insert(table), [
+                                {'id': doc.id, **collection._to_row(data)}
+                                for doc, data in run[start:start + STREAM_BATCH_SIZE]
+                            ])
+                    elif op == 'delete':
+                        ids = [doc.id for doc, _ in run]
+                        for start in range(0, len(ids), STREAM_BATCH_SIZE):
+                            connection.execute(delete(table).where(table.c.id.in_(ids[start:start + STREAM_BATCH_SIZE])))
+                    elif op == 'delete_if':
+                        # e.g. counter cells the increments before emptied
+                        for (field, operator, value), group in itertools.groupby(run, key=lambda write: write[1]):
+                            ids = [doc.id for doc, _ in group]
+                            condition = OPERATORS[operator](table.c[field], value)
+                            for start in range(0, len(ids), STREAM_BATCH_SIZE):
+                                connection.execute(delete(table).where(table.c.id.in_(ids[start:start + STREAM_BATCH_SIZE]), condition))
+                    elif op == 'merge' and _can_upsert(connection, collection, run):
+                        # e.g. a batch of counter increments
+                        _upsert(connection, collection, run)
+                    elif op == 'update' and _same_column_values(collection, run):
+                        # One statement sets the same values on every document,
+                        # e.g. a bulk recategorize
+                        ids = [doc.id for doc, _ in run]
+                        for start in range(0, len(ids), STREAM_BATCH_SIZE):
+                            connection.execute(
+                                update(table).where(table.c.id.in_(ids[start:start + STREAM_BATCH_SIZE])).values(**run[0][1])
+                            )
+                    else:
+                        for doc, data in run:
+                            getattr(doc, f'_{op}')(connection, data)
+                    written.extend((op, doc, data) for doc, data in run)
+        except IntegrityError as e:
+            raise DocumentExistsError("Batch write conflicts with an existing document") from e
+        
+        for op, doc, data in written:
+            if op == 'delete':
+                doc._data = {}
+                doc.exists = False
+            elif op == 'delete_if':
+                # Whether the document was deleted isn't known here
+                continue
+            elif op == 'update':
+                doc._data.update(data)
+            elif op == 'merge':
+                doc._merged(data)
+            else:
+                doc._data = dict(data)
+                doc.exists = True
+        self.writes = []
+        return True
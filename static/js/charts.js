@@ -0,0 +1,93 @@
+// Chart rendering shared by the dashboard and reports pages.
+// The server sends only the numbers; all Plotly styling lives here.
+
+// Plotly's "Plasma" sequential palette
+const CHART_COLORS = ['#0d0887', '#46039f', '#7201a8', '#9c179e', '#bd3786', '#d8576b', '#ed7953', '#fb9f3a', '#fdca26', '#f0f921'];
+
+const CATEGORY_CHART_LAYOUT = {
+    title: { text: 'Expenses by Category', font: { size: 20 } },
+    margin: { l: 50, r: 50, t: 50, b: 50 },
+    legend: {
+        orientation: 'v',
+        yanchor: 'middle',
+        y: 0.5,
+        xanchor: 'right',
+        x: 1.1
+    },
+    paper_bgcolor: 'rgba(0,0,0,0)',
+    plot_bgcolor: 'rgba(0,0,0,0)',
+    font: { color: 'white', size: 14 },
+    height: 500
+};
+
+const TREND_CHART_LAYOUT = {
+    xaxis: { title: { text: 'Date' } },
+    yaxis: { title: { text: 'Amount' } },
+    legend: { title: { text: 'Category' } },
+    barmode: 'stack',
+    margin: { l: 40, r: 20, t: 40, b: 40 },
+    paper_bgcolor: 'rgba(0,0,0,0)',
+    plot_bgcolor: 'rgba(0,0,0,0)',
+    font: { color: 'white' }
+};
+
+// {"categories": {name: total}} -> donut chart
+function renderCategoryChart(element, data) {
+    const names = Object.keys(data.categories);
+    const trace = {
+        type: 'pie',
+        labels: names,
+        values: names.map(name => data.categories[name]),
+        hole: 0.4,
+        textposition: 'inside',
+        textinfo: 'percent+label',
+        textfont: { size: 14 },
+        marker: { colors: CHART_COLORS }
+    };
+    Plotly.newPlot(element, [trace], CATEGORY_CHART_LAYOUT);
+}
+
+// {"period": ..., "buckets": {bucket: {category: total}}} -> stacked bars
+function renderTrendChart(element, data) {
+    const buckets = Object.keys(data.buckets);
+    const categories = [...new Set(buckets.flatMap(bucket => Object.keys(data.buckets[bucket])))].sort();
+    
+    const traces = categories.map((category, index) => {
+        const x = buckets.filter(bucket => category in data.buckets[bucket]);
+        return {
+            type: 'bar',
+            name: category,
+            x: x,
+            y: x.map(bucket => data.buckets[bucket][category]),
+            marker: { color: CHART_COLORS[index % CHART_COLORS.length] }
+        };
+    });
+    
+    const title = data.period === 'year' ? 'Monthly Expenses' : 'Daily Expenses';
+    Plotly.newPlot(element, traces, { ...TREND_CHART_LAYOUT, title: { text: title } });
+}
+
+// Load chart data from the element's data-chart-url and plot it
+function loadChart(element) {
+    fetch(element.getAttribute('data-chart-url'), { credentials: 'same-origin' })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`Chart request failed with status ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(data => {
+            if (!data) {
+                return;
+            }
+            if (data.categories) {
+                renderCategoryChart(element, data);
+            } else if (data.buckets) {
+                renderTrendChart(element, data);
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            element.textContent = 'Could not load chart.';
+        });
+}
@@ -3,26 +3,36 @@
 document.addEventListener('DOMContentLoaded', function() {
     // Initialize expense deletion functionality
     initializeDeleteExpense();
+    
+    // Delete or recategorize selected expenses in one request
+    initializeBatchActions();
+    
+    // Load further pages of expenses as the user scrolls
+    initializeExpensePaging();
+    
+    // Fetch charts after first paint
+    initializeCharts();
 });
 
 // Handle expense deletion
 function initializeDeleteExpense() {
-    const deleteButtons = document.querySelectorAll('.delete-expense');
     const confirmDeleteButton = document.getElementById('confirmDelete');
     const deleteExpenseModal = document.getElementById('deleteExpenseModal');
     
-    if (!deleteButtons.length || !confirmDeleteButton || !deleteExpenseModal) {
+    if (!confirmDeleteButton || !deleteExpenseModal) {
         return; // Elements not found, possibly on another page
     }
     
     const modal = new bootstrap.Modal(deleteExpenseModal);
     let expenseIdToDelete = null;
     
-    deleteButtons.forEach(button => {
-        button.addEventListener('click', function() {
-            expenseIdToDelete = this.getAttribute('data-expense-id');
+    // Delegate so rows appended by paging get the handler too
+    document.addEventListener('click', function(event) {
+        const button = event.target.closest('.delete-expense');
+        if (button) {
+            expenseIdToDelete = button.getAttribute('data-expense-id');
             modal.show();
-        });
+        }
     });
     
     confirmDeleteButton.addEventListener('click', function() {
@@ -55,23 +65,192 @@ function deleteExpense(expenseId, modal) {
     });
 }
 
-// Initialize and render charts if present
+// Track selected rows and send batch delete/recategorize requests
+function initializeBatchActions() {
+    const toolbar = document.getElementById('batchToolbar');
+    const selectAll = document.getElementById('selectAllExpenses');
+    
+    if (!toolbar || !selectAll) {
+        return;
+    }
+    
+    const selectedCount = document.getElementById('batchSelectedCount');
+    const categorySelect = document.getElementById('batchCategory');
+    
+    function selectedIds() {
+        return Array.from(document.querySelectorAll('.expense-select:checked')).map(checkbox => checkbox.value);
+    }
+    
+    function updateToolbar() {
+        const count = selectedIds().length;
+        selectedCount.textContent = `${count} selected`;
+        toolbar.hidden = count === 0;
+    }
+    
+    // Delegate so rows appended by paging are included
+    document.addEventListener('change', function(event) {
+        if (event.target === selectAll) {
+            document.querySelectorAll('.expense-select').forEach(checkbox => {
+                checkbox.checked = selectAll.checked;
+            });
+        }
+        if (event.target === selectAll || event.target.classList.contains('expense-select')) {
+            updateToolbar();
+        }
+    });
+    
+    function sendBatch(body) {
+        fetch(toolbar.getAttribute('data-batch-url'), {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify(body)
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                window.location.reload();
+            } else {
+                alert('Error updating expenses: ' + data.error);
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            alert('An error occurred while updating the expenses.');
+        });
+    }
+    
+    document.getElementById('batchDelete').addEventListener('click', function() {
+        const ids = selectedIds();
+        if (ids.length && confirm(`Delete ${ids.length} expenses? This action cannot be undone.`)) {
+            sendBatch({ action: 'delete', ids: ids });
+        }
+    });
+    
+    document.getElementById('batchCategorize').addEventListener('click', function() {
+        const ids = selectedIds();
+        if (ids.length && categorySelect.value) {
+            sendBatch({ action: 'categorize', ids: ids, category: categorySelect.value });
+        }
+    });
+}
+
+// Fetch the next page of expenses whenever the end of the list scrolls into view
+function initializeExpensePaging() {
+    const sentinel = document.getElementById('expenseListSentinel');
+    const tableBody = document.getElementById('expenseTableBody');
+    
+    if (!sentinel || !tableBody || !('IntersectionObserver' in window)) {
+        return;
+    }
+    
+    let loading = false;
+    
+    const observer = new IntersectionObserver(entries => {
+        if (!entries.some(entry => entry.isIntersecting) || loading) {
+            return;
+        }
+        
+        const cursor = sentinel.getAttribute('data-next-cursor');
+        if (!cursor) {
+            observer.disconnect();
+            sentinel.remove();
+            return;
+        }
+        
+        loading = true;
+        fetch(`/api/expenses?cursor=${encodeURIComponent(cursor)}`)
+            .then(response => response.json())
+            .then(data => {
+                if (!data.success) {
+                    throw new Error(data.error);
+                }
+                
+                data.expenses.forEach(expense => {
+                    tableBody.appendChild(buildExpenseRow(expense));
+                });
+                
+                if (data.next_cursor) {
+                    sentinel.setAttribute('data-next-cursor', data.next_cursor);
+                } else {
+                    observer.disconnect();
+                    sentinel.remove();
+                }
+            })
+            .catch(error => {
+                console.error('Error:', error);
+                observer.disconnect();
+                sentinel.textContent = 'Could not load more expenses.';
+            })
+            .finally(() => {
+                loading = false;
+            });
+    }, { rootMargin: '200px' });
+    
+    observer.observe(sentinel);
+}
+
+// Badge colour per category, matching dashboard.html
+const CATEGORY_BADGES = {
+    'Food': 'bg-success',
+    'Transport': 'bg-info',
+    'Bills': 'bg-danger',
+    'Education': 'bg-primary'
+};
+
+// Build a table row for an expense returned by /api/expenses
+function buildExpenseRow(expense) {
+    const row = document.createElement('tr');
+    
+    const selectCell = document.createElement('td');
+    const checkbox = document.createElement('input');
+    checkbox.type = 'checkbox';
+    checkbox.className = 'form-check-input expense-select';
+    checkbox.value = expense.id;
+    checkbox.setAttribute('aria-label', 'Select expense');
+    checkbox.checked = document.getElementById('selectAllExpenses')?.checked || false;
+    selectCell.appendChild(checkbox);
+    
+    const dateCell = document.createElement('td');
+    dateCell.textContent = expense.date;
+    
+    const categoryCell = document.createElement('td');
+    const badge = document.createElement('span');
+    badge.className = 'badge ' + (CATEGORY_BADGES[expense.category] || 'bg-secondary');
+    badge.textContent = expense.category;
+    categoryCell.appendChild(badge);
+    
+    const amountCell = document.createElement('td');
+    amountCell.textContent = '$' + Number(expense.amount).toFixed(2);
+    
+    const actionsCell = document.createElement('td');
+    const editLink = document.createElement('a');
+    editLink.href = `/edit-expense/${encodeURIComponent(expense.id)}`;
+    editLink.className = 'btn btn-sm btn-outline-primary';
+    editLink.innerHTML = '<i class="fas fa-edit"></i>';
+    
+    const deleteButton = document.createElement('button');
+    deleteButton.className = 'btn btn-sm btn-outline-danger delete-expense';
+    deleteButton.setAttribute('data-expense-id', expense.id);
+    deleteButton.innerHTML = '<i class="fas fa-trash"></i>';
+    
+    actionsCell.append(editLink, ' ', deleteButton);
+    row.append(selectCell, dateCell, categoryCell, amountCell, actionsCell);
+    return row;
+}
+
+// Fetch and render charts once the page is on screen
 function initializeCharts() {
-    // Category chart 
     const categoryChartElement = document.getElementById('categoryChart');
-    if (categoryChartElement && window.categoryChartData) {
-        Plotly.newPlot('categoryChart', 
-                       JSON.parse(window.categoryChartData).data, 
-                       JSON.parse(window.categoryChartData).layout);
+    if (!categoryChartElement) {
+        return;
     }
     
+    loadChart(categoryChartElement);
+    
     // Resize charts when window size changes
     window.addEventListener('resize', function() {
-        if (categoryChartElement && window.categoryChartData) {
-            Plotly.relayout('categoryChart', {
-                'width': categoryChartElement.offsetWidth,
-                'height': categoryChartElement.offsetHeight
-            });
-        }
+        Plotly.Plots.resize(categoryChartElement);
     });
 }
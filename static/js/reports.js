@@ -6,41 +6,22 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Initialize export functionality
     initializeExport();
+    
+    // Initialize bulk import
+    initializeImport();
 });
 
-// Initialize and render charts for reports page
+// Fetch and render charts for reports page once it is on screen
 function initializeReportCharts() {
-    // Category chart 
-    const categoryChartElement = document.getElementById('categoryChart');
-    if (categoryChartElement && window.categoryChartData) {
-        Plotly.newPlot('categoryChart', 
-                       JSON.parse(window.categoryChartData).data, 
-                       JSON.parse(window.categoryChartData).layout);
-    }
+    const chartElements = ['categoryChart', 'trendChart']
+        .map(id => document.getElementById(id))
+        .filter(element => element);
     
-    // Trend chart
-    const trendChartElement = document.getElementById('trendChart');
-    if (trendChartElement && window.trendChartData) {
-        Plotly.newPlot('trendChart', 
-                       JSON.parse(window.trendChartData).data, 
-                       JSON.parse(window.trendChartData).layout);
-    }
+    chartElements.forEach(loadChart);
     
     // Resize charts when window size changes
     window.addEventListener('resize', function() {
-        if (categoryChartElement && window.categoryChartData) {
-            Plotly.relayout('categoryChart', {
-                'width': categoryChartElement.offsetWidth,
-                'height': categoryChartElement.offsetHeight
-            });
-        }
-        
-        if (trendChartElement && window.trendChartData) {
-            Plotly.relayout('trendChart', {
-                'width': trendChartElement.offsetWidth,
-                'height': trendChartElement.offsetHeight
-            });
-        }
+        chartElements.forEach(element => Plotly.Plots.resize(element));
     });
 }
 
@@ -58,6 +39,58 @@ function initializeExport() {
     });
 }
 
+// Upload a CSV or JSON file of expenses and report how it went
+function initializeImport() {
+    const importButton = document.getElementById('importButton');
+    const importFile = document.getElementById('importFile');
+    
+    if (!importButton || !importFile) {
+        return;
+    }
+    
+    importButton.addEventListener('click', () => importFile.click());
+    
+    importFile.addEventListener('change', function() {
+        if (!this.files.length) {
+            return;
+        }
+        
+        const formData = new FormData();
+        formData.append('file', this.files[0]);
+        importButton.disabled = true;
+        
+        fetch(this.getAttribute('data-import-url'), {
+            method: 'POST',
+            body: formData
+        })
+        .then(response => response.json())
+        .then(data => {
+            let message = `Imported ${data.imported || 0} expenses.`;
+            if (data.rejected) {
+                message += `\n${data.rejected} rows were skipped:`;
+                data.errors.slice(0, 5).forEach(error => {
+                    message += `\n  Row ${error.row}: ${error.error}`;
+                });
+            }
+            if (data.error) {
+                message += `\nError: ${data.error}`;
+            }
+            alert(message);
+            if (data.imported) {
+                window.location.reload();
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            alert('An error occurred while importing expenses.');
+        })
+        .finally(() => {
+            importButton.disabled = false;
+            importFile.value = '';
+        });
+    });
+}
+
 // Get current period from URL or default to 'month'
 function getCurrentPeriod() {
     const urlParams = new URLSearchParams(window.location.search);
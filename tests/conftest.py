@@ -0,0 +1,7 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Import the app on the in-memory store; each test picks the store it runs on
+os.environ.setdefault('USE_MOCK_DB', '1')
@@ -0,0 +1,61 @@
+import threading
+import time
+
+import pytest
+
+from app import MockDB
+from sql_db import SQLDB
+import aggregates
+
+USER_ID = 'test-user'
+
+@pytest.fixture(params=['mock', 'sql'])
+def store(request, tmp_path, monkeypatch):
+    store = MockDB() if request.param == 'mock' else SQLDB(f"sqlite:///{tmp_path / 'expenses.db'}")
+    monkeypatch.setattr(aggregates, 'db', store)
+    return store
+
+def add_expense(store, expense_id, amount):
+    expense = {'user_id': USER_ID, 'amount': amount, 'category': 'Food', 'date': '2024-05-01', 'description': ''}
+    batch = store.batch()
+    batch.create(store.collection('expenses').document(expense_id), expense)
+    aggregates.record_expense_change(USER_ID, new_expense=expense, batch=batch)
+    batch.commit()
+
+def test_write_during_rebuild_is_counted(store, monkeypatch):
+    # The first write creates incomplete stats, so the next read rebuilds
+    add_expense(store, 'first', 10.0)
+    
+    writer = threading.Thread(target=add_expense, args=(store, 'second', 5.0))
+    add_to_counts = aggregates._add_to_counts
+    
+    def write_while_rebuilding(counts, expense, sign):
+        # Commit another expense after the rebuild has read the expenses
+        if not writer.is_alive() and writer.ident is None:
+            writer.start()
+            time.sleep(0.2)
+        add_to_counts(counts, expense, sign)
+    
+    monkeypatch.setattr(aggregates, '_add_to_counts', write_while_rebuilding)
+    aggregates.get_user_aggregates(USER_ID)
+    writer.join()
+    
+    stored = aggregates.get_user_aggregates(USER_ID, details=True)
+    assert stored['count'] == 2
+    assert stored['total'] == 15.0
+    assert stored['categories'] == {'Food': {'count': 2, 'total': 15.0}}
+
+def test_emptied_cells_are_deleted(store):
+    add_expense(store, 'only', 10.0)
+    aggregates.get_user_aggregates(USER_ID)
+    
+    doc = store.collection('expenses').document('only')
+    batch = store.batch()
+    batch.delete(doc)
+    aggregates.record_expense_change(USER_ID, old_expense=doc.get().to_dict(), batch=batch)
+    batch.commit()
+    
+    for name in (aggregates.COUNTS_COLLECTION, aggregates.ROLLUPS_COLLECTION):
+        assert list(store.collection(name).where('user_id', '==', USER_ID).stream()) == []
+    stored = aggregates.get_user_aggregates(USER_ID, details=True)
+    assert (stored['count'], stored['num_days'], stored['categories']) == (0, 0, {})
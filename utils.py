@@ -1,130 +1,211 @@
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+import numpy as np
 import json
+import os
 import datetime
-from collections import defaultdict
+import threading
+from collections import OrderedDict
+from models import ExpenseColumns, format_month
+from instrumentation import timed
 
-def generate_category_chart(expenses):
-    """Generate a pie chart for expense categories."""
-    if not expenses:
-        return None
+class ChartCache:
+    """Per-worker LRU cache of rendered chart JSON with a memory cap.
+    
+    Keys include the user's data version, so entries for outdated data are
+    never served and simply age out.
+    """
+    
+    def __init__(self, max_bytes, max_entries):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.entries.move_to_end(key)
+            return self.entries[key]
+    
+    def put(self, key, value):
+        size = len(value) if value else 0
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key) or '')
+            self.entries[key] = value
+            self.size += size
+            while self.size > self.max_bytes or len(self.entries) > self.max_entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted or '')
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+chart_cache = ChartCache(
+    max_bytes=int(os.environ.get("CHART_CACHE_MAX_BYTES", 32 * 1024 * 1024)),
+    max_entries=int(os.environ.get("CHART_CACHE_MAX_ENTRIES", 1024))
+)
+
+_MISSING = object()
+
+def cached_chart(user_id, kind, period, version, build, scope=None):
+    """Return chart JSON from the cache, calling build() only on a miss."""
+    key = (user_id, kind, period, version, scope)
+    chart = chart_cache.get(key, _MISSING)
+    if chart is _MISSING:
+        chart = build()
+        chart_cache.put(key, chart)
+    return chart
+
+def as_columns(expenses):
+    """Accept a list of Expense objects or an ExpenseColumns view."""
+    if isinstance(expenses, ExpenseColumns):
+        return expenses
+    return ExpenseColumns.from_expenses(expenses)
+
+def aggregate_category_totals(aggregates):
+    """Get category -> total amount from a user's running aggregates."""
+    return {category: bucket['total'] for category, bucket in aggregates['categories'].items()}
+
+@timed('analytics')
+def bucket_trend(days, category_codes, amounts, categories, period='month'):
+    """Sum amounts into stacked-bar series for the trend chart.
+    
+    Days are epoch days. 'year' buckets by calendar month, 'week' and
+    'month' (and anything else) by day. Returns the bucket labels, the
+    series names, a buckets x series matrix of totals and a matching mask
+    of which cells hold any expense. Series come in no particular order;
+    the client sorts them for the legend.
+    """
+    if period == 'year':
+        buckets = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    else:
+        buckets = days.astype(np.int64)
+    bucket_keys, bucket_index = np.unique(buckets, return_inverse=True)
     
-    # Create a dictionary to store total amount by category
-    category_totals = defaultdict(float)
-    
-    for expense in expenses:
-        category_totals[expense.category] += expense.amount
-    
-    # Convert to DataFrame
-    df = pd.DataFrame({
-        'Category': list(category_totals.keys()),
-        'Amount': list(category_totals.values())
-    })
-    
-    # Create a pie chart
-    fig = px.pie(
-        df, 
-        values='Amount', 
-        names='Category',
-        title='Expenses by Category',
-        color_discrete_sequence=px.colors.sequential.Plasma
-    )
+    # Only categories that occur
+    codes, series_index = np.unique(category_codes, return_inverse=True)
     
-    fig.update_traces(textposition='inside', textinfo='percent+label')
-    fig.update_layout(
-        margin=dict(l=50, r=50, t=50, b=50),
-        legend=dict(
-            orientation="v",
-            yanchor="middle",
-            y=0.5,
-            xanchor="right",
-            x=1.1
-        ),
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        font=dict(color='white', size=14),
-        title=dict(
-            font=dict(size=20)
-        ),
-        height=500
-    )
-    fig.update_traces(
-        textfont=dict(size=14),
-        hole=0.4
-    )
+    shape = (len(bucket_keys), len(codes))
+    cells = bucket_index * len(codes) + series_index
+    totals = np.bincount(cells, weights=amounts, minlength=shape[0] * shape[1]).reshape(shape)
+    present = np.bincount(cells, minlength=shape[0] * shape[1]).reshape(shape) > 0
     
-    return fig.to_json()
+    if period == 'year':
+        labels = np.datetime_as_string(bucket_keys.astype('datetime64[M]'), unit='M').tolist()
+    else:
+        labels = bucket_keys.astype('datetime64[D]').astype(datetime.date).tolist()
+    
+    return {
+        'labels': labels,
+        'series': [categories[code] for code in codes.tolist()],
+        'totals': totals,
+        'present': present
+    }
+
+@timed('analytics')
+def analyze_expenses(expenses, period='month'):
+    """Compute every input the stats, charts and tips need in one go.
+    
+    Builds the columnar view once, then derives totals, category sums,
+    distinct days, the largest expense and the per-period trend series
+    from the same arrays. Pass the result to get_expense_statistics,
+    trend_chart_data and generate_spending_tips to share it between them.
+    """
+    columns = as_columns(expenses)
+    analysis = {
+        'columns': columns,
+        'period': period,
+        'count': len(columns),
+        'total': 0.0,
+        'num_days': 0,
+        'largest_expense': 0,
+        'category_totals': {},
+        'trend': None
+    }
+    if not len(columns):
+        return analysis
+    
+    analysis['total'] = float(columns.amounts.sum())
+    analysis['largest_expense'] = float(columns.amounts.max())
+    analysis['category_totals'] = columns.category_totals()
+    
+    # Skip expenses without a usable date for the day based figures
+    dated = columns.dated()
+    days = columns.days[dated]
+    if not days.size:
+        return analysis
+    amounts = columns.amounts[dated]
+    
+    analysis['trend'] = bucket_trend(days, columns.category_codes[dated], amounts, columns.categories, period)
+    if period == 'year':
+        analysis['num_days'] = int(np.unique(days).size)
+    else:
+        # Daily buckets, so every bucket is one distinct day
+        analysis['num_days'] = len(analysis['trend']['labels'])
+    return analysis
+
+def _as_analysis(expenses, period=None):
+    """Reuse a precomputed analysis, redoing it only for a different period."""
+    if isinstance(expenses, dict):
+        if period is None or expenses['period'] == period:
+            return expenses
+        return analyze_expenses(expenses['columns'], period)
+    return analyze_expenses(expenses, period or 'month')
 
-def generate_trend_chart(expenses, period='month'):
-    """Generate a trend chart for expenses over time."""
-    if not expenses:
+@timed('analytics')
+def category_chart_data(category_totals):
+    """Compact category chart payload: {"categories": {name: total}}.
+    
+    Styling lives in the client, so only the numbers are sent.
+    """
+    if not category_totals:
         return None
     
-    # Create a DataFrame
-    data = []
-    for expense in expenses:
-        try:
-            if isinstance(expense.date, datetime.datetime):
-                date = expense.date
-            elif isinstance(expense.date, str):
-                date = datetime.datetime.strptime(expense.date, '%Y-%m-%d')
-            else:
-                continue  # Skip invalid dates
-                
-            data.append({
-                'date': date,
-                'amount': expense.amount,
-                'category': expense.category
-            })
-        except (ValueError, TypeError):
-            continue  # Skip any date parsing errors
-    
-    df = pd.DataFrame(data)
-    
-    # Group by date and sum the amounts
-    if period == 'week' or period == 'month':
-        # Daily grouping for week or month
-        df['date_group'] = df['date'].dt.date
-        title = 'Daily Expenses'
-    elif period == 'year':
-        # Monthly grouping for year
-        df['date_group'] = df['date'].dt.strftime('%Y-%m')
-        title = 'Monthly Expenses'
-    else:
-        # Default to daily
-        df['date_group'] = df['date'].dt.date
-        title = 'Daily Expenses'
-    
-    daily_totals = df.groupby(['date_group', 'category'])['amount'].sum().reset_index()
-    
-    # Create a bar chart
-    fig = px.bar(
-        daily_totals, 
-        x='date_group', 
-        y='amount',
-        color='category',
-        title=title,
-        labels={'date_group': 'Date', 'amount': 'Amount', 'category': 'Category'},
-        color_discrete_sequence=px.colors.sequential.Plasma
-    )
+    categories = {str(name): round(total, 2) for name, total in category_totals.items()}
+    return json.dumps({'categories': categories}, separators=(',', ':'))
+
+@timed('analytics')
+def trend_chart_data(expenses, period='month'):
+    """Compact trend chart payload: {"period", "buckets": {bucket: {category: total}}}."""
+    analysis = _as_analysis(expenses, period)
+    trend = analysis['trend']
+    if trend is None:
+        return None
     
-    fig.update_layout(
-        xaxis_title='Date',
-        yaxis_title='Amount',
-        legend_title='Category',
-        barmode='stack',
-        margin=dict(l=40, r=20, t=40, b=40),
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        font=dict(color='white')
-    )
+    series = [str(category) for category in trend['series']]
+    buckets = {}
+    for label, totals, present in zip(trend['labels'], trend['totals'].tolist(), trend['present'].tolist()):
+        buckets[str(label)] = {
+            category: round(total, 2)
+            for category, total, has_value in zip(series, totals, present)
+            if has_value
+        }
     
-    return fig.to_json()
+    return json.dumps({'period': period, 'buckets': buckets}, separators=(',', ':'))
 
+@timed('analytics')
+def monthly_trend_chart_data(rollups):
+    """The yearly trend_chart_data payload, built from monthly rollup cells"""
+    if not rollups:
+        return None
+    
+    buckets = {}
+    for rollup in rollups:
+        buckets.setdefault(format_month(rollup['month']), {})[str(rollup['category'])] = round(rollup['total'], 2)
+    
+    return json.dumps({'period': 'year', 'buckets': buckets}, separators=(',', ':'))
+
+@timed('analytics')
 def get_expense_statistics(expenses):
     """Calculate expense statistics."""
-    if not expenses:
+    analysis = _as_analysis(expenses)
+    if not analysis['count']:
         return {
             'total': 0,
             'average_daily': 0,
@@ -132,36 +213,29 @@ def get_expense_statistics(expenses):
             'largest_expense': 0
         }
     
-    # Calculate total spent
-    total = sum(expense.amount for expense in expenses)
-    
-    # Calculate average daily spending
-    dates = set()
-    for expense in expenses:
-        if isinstance(expense.date, datetime.datetime):
-            dates.add(expense.date.date())
-        else:
-            # If date is a string, parse it
-            try:
-                date = datetime.datetime.strptime(expense.date, '%Y-%m-%d').date()
-                dates.add(date)
-            except (ValueError, TypeError):
-                # Skip invalid dates
-                pass
-    
-    num_days = len(dates) if dates else 1
-    average_daily = total / num_days
-    
-    # Find highest expense
-    highest_expense = max(expenses, key=lambda x: x.amount) if expenses else None
-    largest_expense = highest_expense.amount if highest_expense else 0
-    
-    # Calculate category totals
-    category_totals = defaultdict(float)
-    
-    for expense in expenses:
-        category_totals[expense.category] += expense.amount
+    # Calculate average daily spending over distinct dated days
+    total = analysis['total']
+    average_daily = total / (analysis['num_days'] or 1)
     
+    return _build_statistics(total, average_daily, analysis['largest_expense'], analysis['category_totals'])
+
+@timed('analytics')
+def get_aggregate_statistics(aggregates):
+    """Calculate expense statistics from aggregates loaded with details=True."""
+    if not aggregates['count']:
+        return get_expense_statistics([])
+    
+    total = aggregates['total']
+    num_days = aggregates['num_days'] or 1
+    
+    return _build_statistics(
+        total,
+        total / num_days,
+        aggregates['max_amount'],
+        aggregate_category_totals(aggregates)
+    )
+
+def _build_statistics(total, average_daily, largest_expense, category_totals):
     # Find top category
     top_category = max(category_totals.items(), key=lambda x: x[1])[0] if category_totals else 'None'
     
@@ -179,24 +253,26 @@ def get_expense_statistics(expenses):
         'categories': categories
     }
 
+@timed('analytics')
 def generate_spending_tips(expenses):
     """Generate spending tips based on expense patterns."""
-    if not expenses:
+    analysis = _as_analysis(expenses)
+    if not analysis['count']:
         return ["Start tracking your expenses to get personalized saving tips!"]
     
+    return generate_spending_tips_from_totals(analysis['category_totals'])
+
+@timed('analytics')
+def generate_spending_tips_from_totals(category_totals):
+    """Generate spending tips from precomputed category totals."""
     tips = []
     
     # Calculate category percentages
-    total = sum(expense.amount for expense in expenses)
+    total = sum(category_totals.values())
     
     if total <= 0:
         return ["Start tracking your expenses to get personalized saving tips!"]
     
-    category_totals = defaultdict(float)
-    
-    for expense in expenses:
-        category_totals[expense.category] += expense.amount
-    
     # Calculate percentage for each category
     category_percentages = {cat: (amount / total) * 100 for cat, amount in category_totals.items()}
     